@@ -30,6 +30,8 @@ volatile uint8_t adc_flag;				// Flag for ADC
 volatile uint16_t odo_cnt;				// Global counter for odometer
 volatile struct Sensordata sensor_data; // Sensordata
 volatile uint8_t chosen_data = -1;		// Current chosen data to send on TWI
+volatile uint8_t burst_data = -1;		// Register sent in the current burst read
+volatile uint8_t latched_data[8];		// Register file latched at start of a read
 
 // 6.5 == 79
 
@@ -266,6 +268,30 @@ ISR(ADC_vect)
 	}
 }
 
+// Copy register file, in Internal_address order, for the TWI transmitter
+void latch_registers()
+{
+	latched_data[0] = sensor_data.automatic_drive;
+	latched_data[1] = sensor_data.ir_front;
+	latched_data[2] = sensor_data.ir_left;
+	latched_data[3] = sensor_data.ir_right;
+	latched_data[4] = sensor_data.odometer_h;
+	latched_data[5] = sensor_data.odometer_l;
+	latched_data[6] = sensor_data.gyro;
+	latched_data[7] = sensor_data.start_drive;
+}
+
+// Get latched register to send on TWI
+uint8_t get_register(uint8_t address)
+{
+	if (address < sizeof(latched_data))
+	{
+		return latched_data[address];
+	}
+
+	return -1;
+}
+
 ISR(TWI_vect)
 {
 
@@ -277,45 +303,23 @@ ISR(TWI_vect)
 	// Slave transmitter
 	case 0xA8: // Own address received
 
+		// Latch all registers so a burst read gets a consistent snapshot
+		latch_registers();
+
 		// Load data to data register
-		switch (chosen_data)
-		{
-		case 0:
-			twi_data = sensor_data.automatic_drive;
-			break;
-		case 1:
-			twi_data = sensor_data.ir_front;
-			break;
-		case 2:
-			twi_data = sensor_data.ir_left;
-			break;
-		case 3:
-			twi_data = sensor_data.ir_right;
-			break;
-		case 4:
-			twi_data = sensor_data.odometer_h;
-			break;
-		case 5:
-			twi_data = sensor_data.odometer_l;
-			break;
-		case 6:
-			twi_data = sensor_data.gyro;
-			break;
-		case 7:
-			twi_data = sensor_data.start_drive;
-			break;
-		default:
-			twi_data = -1;
-			break;
-		}
+		burst_data = chosen_data;
+		twi_data = get_register(burst_data);
 
 		TWDR = twi_data;
 
 		TWCR |= (1 << TWINT) | (1 << TWEA);
 
 		break;
-	case 0xB8: // Data byte sent, ACK received
-		TWCR |= (1 << TWINT);
+	case 0xB8: // Data byte sent, ACK received. Master wants next register (burst read)
+		burst_data++;
+		TWDR = get_register(burst_data);
+
+		TWCR |= (1 << TWINT) | (1 << TWEA);
 		break;
 
 	case 0xC0: // Last byte sent and NACK received
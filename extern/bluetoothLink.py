@@ -0,0 +1,98 @@
+from PySide6.QtCore import *
+import queue
+import select
+import socket
+import struct
+import protocol
+
+ROBOT_ADDRESS = ("B8:27:EB:4E:FF:90", 4)
+POLL_TIMEOUT = 0.02  # Sekunder mellan kontroller av kommandon att skicka
+
+
+# Bluetooth-anslutningen i en egen tråd. Anslutning, send och recv blockerar
+# aldrig GUI-tråden. Ramar avkodas här och skickas till GUI:t med signaler,
+# en gång per recv med allt som kom i den.
+class BluetoothLink(QThread):
+    connected = Signal()
+    connectFailed = Signal(str)
+    disconnected = Signal(str)
+    badData = Signal(str)
+    snapshotReceived = Signal(object)
+    cellsReceived = Signal(list)
+    telemetryReceived = Signal(list)
+
+    def __init__(self, address=ROBOT_ADDRESS, parent=None):
+        super().__init__(parent)
+        self.address = address
+        self.commands = queue.Queue()
+        self.running = True
+
+    def makeSocket(self):
+        return socket.socket(socket.AF_BLUETOOTH, socket.SOCK_STREAM, socket.BTPROTO_RFCOMM)
+
+    # Kan anropas från GUI-tråden, skickas av länktråden
+    def sendCommand(self, command):
+        self.commands.put(protocol.encode_command(command))
+
+    def stop(self):
+        self.running = False
+
+    def run(self):
+        try:
+            client = self.makeSocket()
+            client.connect(self.address)
+        except OSError as e:
+            self.connectFailed.emit(str(e))
+            return
+
+        self.connected.emit()
+
+        reader = protocol.Frame_reader()
+        reason = "Disconnected"
+        try:
+            while self.running:
+                message_out = b''
+                while not self.commands.empty():
+                    message_out += self.commands.get()
+                if message_out:
+                    client.sendall(message_out)
+
+                if select.select([client], [], [], POLL_TIMEOUT)[0]:
+                    data = client.recv(protocol.RECV_SIZE)
+                    if not data:
+                        reason = "Lost connection."
+                        break
+
+                    self.handleFrames(reader.feed(data))
+        except OSError as e:
+            reason = "Lost connection: " + str(e)
+        finally:
+            client.close()
+
+        self.disconnected.emit(reason)
+
+    # Samla allt i ramarna till en uppdatering av varje slag
+    def handleFrames(self, frames):
+        snapshot = None
+        cells = []
+        telemetry = None
+
+        for frame_type, payload in frames:
+            try:
+                if frame_type == protocol.SNAPSHOT:
+                    # Ersätter alla celler som kom före
+                    snapshot = protocol.decode_snapshot(payload)
+                    cells = []
+                elif frame_type == protocol.CELLS:
+                    cells += protocol.decode_cells(payload)
+                elif frame_type == protocol.TELEMETRY:
+                    telemetry = protocol.decode_telemetry(payload)
+            except (ValueError, struct.error) as e:
+                self.badData.emit(str(e))
+
+        if snapshot is not None:
+            self.snapshotReceived.emit(snapshot)
+        if cells:
+            self.cellsReceived.emit(cells)
+        if telemetry is not None:
+            self.telemetryReceived.emit(telemetry)
@@ -20,32 +20,32 @@ class KeyPressFilter(QObject):
             if key == 87 or key == 83 or key == 65 or key == 68 or key == 81 or key == 69:
                 if widget.connected:
                     dir = "stop"
-                    widget.client.send(dir.encode('utf-8'))
+                    widget.sendCommand(dir)
 
         if event.type() == QEvent.KeyPress and not event.isAutoRepeat():
             key = event.key()
             if widget.connected:
                 if key == 87:
                     dir = "fwd"  # W
-                    widget.client.send(dir.encode('utf-8'))
+                    widget.sendCommand(dir)
                 elif key == 83:
                     dir = "back"  # S
-                    widget.client.send(dir.encode('utf-8'))
+                    widget.sendCommand(dir)
                 elif key == 65:
                     dir = "left"  # A
-                    widget.client.send(dir.encode('utf-8'))
+                    widget.sendCommand(dir)
                 elif key == 68:
                     dir = "right"  # D
-                    widget.client.send(dir.encode('utf-8'))
+                    widget.sendCommand(dir)
                 elif key == 88:
                     dir = "stop"  # X
-                    widget.client.send(dir.encode('utf-8'))
+                    widget.sendCommand(dir)
                 elif key == 81:
                     dir = "fwd_left"
-                    widget.client.send(dir.encode('utf-8'))
+                    widget.sendCommand(dir)
                 elif key == 69:
                     dir = "fwd_right"
-                    widget.client.send(dir.encode('utf-8'))
+                    widget.sendCommand(dir)
 
                 widget.pressedKey.setText("Key Pressed: " + dir)
 
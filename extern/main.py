@@ -1,5 +1,9 @@
 import sys
 import os
+
+# protocol.py och grid.py delas med roboten och ligger i ../pi
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "pi"))
+
 from PySide6.QtWidgets import *
 from PySide6.QtCore import *
 from PySide6.QtGui import *
@@ -1,8 +1,23 @@
 from PySide6.QtWidgets import *
 from PySide6.QtCore import *
 from PySide6.QtGui import *
-import socket
 from keyPressed import *
+from bluetoothLink import *
+import grid
+import protocol
+
+# Kartan är MAP_CELLS x MAP_CELLS rutor, cell (0, 0) ligger i rutan MAP_ORIGIN
+CELL_SIZE = 20
+MAP_CELLS = 80
+MAP_ORIGIN = 40
+
+BRUSHES = {
+    "w": QBrush(QColor.fromRgb(214, 30, 48)),
+    "e": QBrush(QColor.fromRgb(30, 214, 55)),
+    "u": QBrush(QColor.fromRgb(214, 205, 30)),
+    "r": QBrush(QColor.fromRgb(0, 250, 225)),
+    "p": QBrush(QColor.fromRgb(255, 0, 255)),
+}
 
 
 class MainWindow(QMainWindow):
@@ -10,6 +25,7 @@ class MainWindow(QMainWindow):
     def __init__(self, parent=None):
         super().__init__(parent=parent)
         self.connected = False  # Flagga för att hålla koll på om anslutningen är etablerad
+        self.link = None
         self.send_coord = True
         self.is_mapping = False
         self.paused_mapping = False
@@ -23,7 +39,6 @@ class MainWindow(QMainWindow):
         self.initButton()
         self.initLabels()
         self.initKeyPress()
-        self.initTimer()
         self.initLayout()
 
         # Skapa en palett för bakgrundsfärg
@@ -67,12 +82,6 @@ class MainWindow(QMainWindow):
                                             "font: bold 14px;"
                                             "height: 30px;")
 
-    def initTimer(self):
-        # Skapa en timer för att periodiskt hämta väggkoordinater från Bluetooth-enhetens
-        self.timer = QTimer()
-        self.timer.timeout.connect(self.getCoords)
-        self.timer.setInterval(500)
-
     def initKeyPress(self):
         # Skapa en nyckelpressfiltreringsinstans
         self.eventFilter = KeyPressFilter(parent=self)
@@ -81,6 +90,8 @@ class MainWindow(QMainWindow):
     def initTerminal(self):
         self.terminal = QTextEdit()
         self.terminal.setFixedHeight(200)
+        # Telemetri kommer flera gånger per sekund, spara bara de senaste raderna
+        self.terminal.document().setMaximumBlockCount(500)
         self.terminal.setTextColor(QColor.fromRgb(114, 250, 48))
         self.terminal.setStyleSheet("background-color: #383838;"
                                     "border-color: none;"
@@ -88,13 +99,27 @@ class MainWindow(QMainWindow):
                                     "color: #72FA30;")
 
     def initRobot(self):
-        robot = QGraphicsRectItem(800, 800, 20, 20)
-        brush_robot = QBrush(QColor.fromRgb(0, 250, 225))
-        robot.setBrush(brush_robot)
-        self.map_scene.addItem(robot)
+        # En robotruta som flyttas, ritas ovanför kartan
+        self.robot_item = QGraphicsRectItem(0, 0, CELL_SIZE, CELL_SIZE)
+        self.robot_item.setBrush(BRUSHES["r"])
+        self.robot_item.setZValue(1)
+        self.robot_item.setVisible(False)
+        self.map_scene.addItem(self.robot_item)
 
     def initMap(self):
-        self.map_scene = QGraphicsScene(0, 0, 1600, 1600)
+        self.map_scene = QGraphicsScene(0, 0, MAP_CELLS * CELL_SIZE, MAP_CELLS * CELL_SIZE)
+
+        # En ruta per cell skapas en gång, uppdateringar byter bara färg
+        self.cell_items = []
+        self.cell_types = [None] * (MAP_CELLS * MAP_CELLS)
+        for index in range(MAP_CELLS * MAP_CELLS):
+            rect = QGraphicsRectItem(0, 0, CELL_SIZE, CELL_SIZE)
+            rect.setPos(index % MAP_CELLS * CELL_SIZE, index // MAP_CELLS * CELL_SIZE)
+            rect.setVisible(False)
+            self.map_scene.addItem(rect)
+            self.cell_items.append(rect)
+
+        self.initRobot()
 
         self.map_view = QGraphicsView()
         self.map_view.setScene(self.map_scene)
@@ -146,89 +171,127 @@ class MainWindow(QMainWindow):
         container.setLayout(self.layout_v)
         self.setCentralWidget(container)
 
+    def getCellIndex(self, x, y):
+        column = x + MAP_ORIGIN
+        row = y + MAP_ORIGIN
+        if not (0 <= column < MAP_CELLS and 0 <= row < MAP_CELLS):
+            return None
+
+        return row * MAP_CELLS + column
+
     def drawMapEntity(self, type, x, y):
-        # Rita en vägg på kartan
-        rect = QGraphicsRectItem(0, 0, 20, 20)
-        rect.setPos(x*20 + 800, y*20 + 800)
-        if type == "w":
-            brush = QBrush(QColor.fromRgb(214, 30, 48))
-            rect.setBrush(brush)
-            self.map_scene.addItem(rect)
-        elif type == "e":
-            brush = QBrush(QColor.fromRgb(30, 214, 55))
-            rect.setBrush(brush)
-            self.map_scene.addItem(rect)
-        elif type == "u":
-            brush = QBrush(QColor.fromRgb(214, 205, 30))
-            rect.setBrush(brush)
-            self.map_scene.addItem(rect)
-        elif type == "r":
-            self.terminal.append("ROBOT")
-            brush = QBrush(QColor.fromRgb(0, 250, 225))
-            rect.setBrush(brush)
-            self.map_scene.addItem(rect)
-        elif type == "p":
-            brush = QBrush(QColor.fromRgb(255, 0, 255))
-            rect.setBrush(brush)
-            self.map_scene.addItem(rect)
+        # Rita en ruta på kartan
+        if type == "r":
+            self.moveRobot(x, y)
+            return
+
+        index = self.getCellIndex(x, y)
+        if index is None or type not in BRUSHES or self.cell_types[index] == type:
+            return
+
+        rect = self.cell_items[index]
+        rect.setBrush(BRUSHES[type])
+        rect.setVisible(True)
+        self.cell_types[index] = type
+
+    def clearMap(self):
+        for index, type in enumerate(self.cell_types):
+            if type is not None:
+                self.cell_items[index].setVisible(False)
+                self.cell_types[index] = None
+
+        self.robot_item.setVisible(False)
+
+    def drawSnapshot(self, snapshot):
+        # Rita om hela kartan från en ögonblicksbild av robotens karta
+        width, height, robot_pos, cells = snapshot
+
+        self.clearMap()
+        for index, code in enumerate(cells):
+            x, y = index % width, index // width
+            if code == grid.EMPTY:
+                self.drawMapEntity("e", y - 7, x - 7)
+            elif code == grid.WALL:
+                self.drawMapEntity("w", y - 7, x - 7)
+
+        self.moveRobot(robot_pos[1] - 7, robot_pos[0] - 7)
+
+    def drawCells(self, cells):
+        for cell_type, x, y in cells:
+            self.drawMapEntity(protocol.CELL_LETTERS[cell_type], y - 7, x - 7)
 
     def moveRobot(self, x, y):
-        # oldRobot = self.map_scene.itemAt(self.robot_x*20 + 800, self.robot_y*20 + 800, QTransform())
-        # self.map_scene.removeItem(oldRobot)
-
-        robot = QGraphicsRectItem(0, 0, 20, 20)
-        robot.setPos((x*20 + 800), (y*20 + 800))
+        self.robot_item.setPos((x + MAP_ORIGIN) * CELL_SIZE, (y + MAP_ORIGIN) * CELL_SIZE)
+        self.robot_item.setVisible(True)
         self.robot_x = x
         self.robot_y = y
+        # self.map_view.centerOn(self.robot_item)
 
-        brush_robot = QBrush(QColor.fromRgb(0, 250, 225))
-        robot.setBrush(brush_robot)
-
-        self.map_scene.addItem(robot)
-        # self.map_view.centerOn(robot)
+    def sendCommand(self, command):
+        self.link.sendCommand(command)
 
     def disconnect(self):
         self.terminal.append("Disconnecting...")
-        self.client.close()
-        self.timer.stop()
+        self.link.stop()
+
+    def connectToBT(self):
+        # Försök ansluta till Bluetooth-enheten, görs i länktråden
+        if self.link is None:
+            self.terminal.append("Trying to connect...")
+            self.connect_button.setEnabled(False)
+
+            self.link = BluetoothLink(parent=self)
+            self.link.connected.connect(self.linkConnected)
+            self.link.connectFailed.connect(self.linkConnectFailed)
+            self.link.disconnected.connect(self.linkDisconnected)
+            self.link.badData.connect(self.badData)
+            self.link.snapshotReceived.connect(self.drawSnapshot)
+            self.link.cellsReceived.connect(self.drawCells)
+            self.link.telemetryReceived.connect(self.updateStatus)
+            self.link.start()
+        elif self.connected:
+            self.disconnect()
+
+    def linkConnected(self):
+        self.connected = True
+        self.connect_button.setEnabled(True)
+        self.terminal.append("Succeeded to connect")
+        self.connect_button.setText("Disconnect from robot")
+
+    def linkConnectFailed(self, error):
+        self.terminal.append("Failed to connect")
+        self.link.wait()
+        self.link = None
+        self.connect_button.setEnabled(True)
+
+    def linkDisconnected(self, reason):
+        self.link.wait()
+        self.link = None
         self.connected = False
         self.connect_button.setText("Connect to robot")
-        self.terminal.append("Disconnected")
+        self.terminal.append(reason)
 
-    def connectToBT(self):
-        # Försök ansluta till Bluetooth-enheten
-        try:
-            if not self.connected:
-                self.terminal.append("Trying to connect...")
-                self.client = socket.socket(
-                    socket.AF_BLUETOOTH, socket.SOCK_STREAM, socket.BTPROTO_RFCOMM)
-                self.client.connect(("B8:27:EB:4E:FF:90", 4))
-                self.connected = True
-
-                self.timer.start()
-
-                self.terminal.append("Succeeded to connect")
-                self.connect_button.setText("Disconnect from robot")
-            else:
-                self.disconnect()
-        except OSError:
-            self.terminal.append("Failed to connect")
-            pass
+    def badData(self, error):
+        self.terminal.append("Bad data: " + error)
+
+    def closeEvent(self, event):
+        if self.link is not None:
+            self.link.stop()
+            self.link.wait()
+        super().closeEvent(event)
 
     def start_mapping(self):
 
         if self.connected and self.auto_drive:
 
             if not self.is_mapping:
-                message = "start mapping"
-                self.client.send(message.encode('utf-8'))
-                self.map_scene.clear()
+                self.sendCommand("start mapping")
+                self.clearMap()
                 self.map_view.viewport().update()
                 self.terminal.append("Sent start mapping")
 
             elif self.is_mapping:
-                message = "stop mapping"
-                self.client.send(message.encode('utf-8'))
+                self.sendCommand("stop mapping")
                 self.terminal.append("Sent stop mapping")
 
     def pause_mapping(self):
@@ -236,62 +299,35 @@ class MainWindow(QMainWindow):
         if self.is_mapping and self.connected and self.auto_drive:
 
             if not self.paused_mapping:
-                message = "pause mapping"
-                self.client.send(message.encode('utf-8'))
+                self.sendCommand("pause mapping")
 
                 self.terminal.append("Sent pause mapping")
             elif self.paused_mapping:
 
                 self.terminal.append("Sent resume mapping")
-                message = "unpause mapping"
-                self.client.send(message.encode('utf-8'))
-
-    def getCoords(self):
-        # Skicka en förfrågan om koordinater och rita väggen baserat på svaret
-        try:
-            message = "send data"
-
-            self.client.send(message.encode('utf-8'))
-
-            data = self.client.recv(1024)
-
-            decodedData = data.decode('utf-8')
-            decodedData = decodedData.replace("\n", "")
-            split_data = decodedData.split()
-
-            sensor_data = split_data[:16]
-            coord_data = split_data[16:]
-
-            for i in range(0, len(coord_data), 3):
-
-                if coord_data[0] != "no_coord_data" and decodedData != "":
-                    self.drawMapEntity(coord_data[i], int(
-                        coord_data[i+2]) - 7, int(coord_data[i+1]) - 7)
-
-            if decodedData != "":
-                self.terminal.append(decodedData)
-                sensor_data = decodedData.split()
-                if sensor_data[1] == "0":
-                    self.auto_drive = False
-                    self.user_drive_status.setText("User drive: Active")
-                elif sensor_data[1] == "1":
-                    self.auto_drive = True
-                    self.user_drive_status.setText("User drive: Disabled")
-                if sensor_data[13] == "0":
-                    self.mapping_status.setText("Mapping: Disabled")
-                    self.start_map_button.setText("Start mapping")
-                    self.is_mapping = False
-                    self.paused_mapping = False
-                elif sensor_data[13] == "1":
-                    self.mapping_status.setText("Mapping: Active")
-                    self.start_map_button.setText("Stop mapping")
-                    self.is_mapping = True
-                if sensor_data[15] == "0":
-                    self.pause_map_button.setText("Pause mapping")
-                    self.paused_mapping = False
-                elif sensor_data[15] == "1":
-                    self.pause_map_button.setText("Resume mapping")
-                    self.paused_mapping = True
-        except ConnectionAbortedError as e:
-            self.terminal.append("Lost connection.")
-            self.disconnect()
+                self.sendCommand("unpause mapping")
+
+    def updateStatus(self, sensor_data):
+        self.terminal.append("auto_drive: {} ir_front: {:.2f} ir_left: {:.2f} ir_right: {:.2f} "
+                             "odometer: {} gyro: {} is_mapping: {} is_paused: {}".format(*sensor_data))
+        if sensor_data[0] == 0:
+            self.auto_drive = False
+            self.user_drive_status.setText("User drive: Active")
+        elif sensor_data[0] == 1:
+            self.auto_drive = True
+            self.user_drive_status.setText("User drive: Disabled")
+        if sensor_data[6] == 0:
+            self.mapping_status.setText("Mapping: Disabled")
+            self.start_map_button.setText("Start mapping")
+            self.is_mapping = False
+            self.paused_mapping = False
+        elif sensor_data[6] == 1:
+            self.mapping_status.setText("Mapping: Active")
+            self.start_map_button.setText("Stop mapping")
+            self.is_mapping = True
+        if sensor_data[7] == 0:
+            self.pause_map_button.setText("Pause mapping")
+            self.paused_mapping = False
+        elif sensor_data[7] == 1:
+            self.pause_map_button.setText("Resume mapping")
+            self.paused_mapping = True
@@ -1,12 +1,19 @@
 import queue
 
 import copy
-import heapq
 
 from enum import Enum
+import grid
+import search
 
 WALL_DETECTION_THRESHOLD = 20
-START_POS = (8, 8)
+MAP_SIZE = 17
+START_POS = (MAP_SIZE // 2, MAP_SIZE // 2)
+# Scan side and front squares at every square centre passed while driving,
+# and keep driving when the square in front is the next one to visit
+SCAN_WHILE_DRIVING = True
+DRIVE_COST = 1.125  # Cost of driving one square
+TURN_COST = 1.5  # Extra cost of a turn
 
 
 class Direction(Enum):
@@ -22,6 +29,11 @@ class Compass(Enum):
     EAST = (0, 1)
 
 
+# Compass in the order used by search.DIRECTIONS
+HEADINGS = list(Compass)
+HEADING_OFFSETS = [heading.value for heading in HEADINGS]
+
+
 class Instruction(Enum):
     ROTATE_WEST = 0
     ROTATE_EAST = 1
@@ -30,10 +42,19 @@ class Instruction(Enum):
     DRIVE = 4
 
 
+ROTATE_INSTRUCTIONS = {
+    Compass.NORTH: Instruction.ROTATE_NORTH,
+    Compass.SOUTH: Instruction.ROTATE_SOUTH,
+    Compass.WEST: Instruction.ROTATE_WEST,
+    Compass.EAST: Instruction.ROTATE_EAST,
+}
+
+
+# Values are the codes stored in grid.Grid
 class Block_type(Enum):
-    UNKNOWN = 'unknown'
-    EMPTY = 'empty'
-    WALL = 'wall'
+    UNKNOWN = grid.UNKNOWN
+    EMPTY = grid.EMPTY
+    WALL = grid.WALL
 
 
 class Autopilot:
@@ -41,11 +62,16 @@ class Autopilot:
         self.motor = motor
         self.server = server
         self.pos = START_POS
-        self.stack = []
         self.heading = Compass.NORTH
-        self.map = [[Block_type.UNKNOWN for x in range(17)] for y in range(17)]
-        self.visited = set()
+        self.map = grid.Grid(MAP_SIZE, MAP_SIZE)
+        # Empty squares with an unknown neighbour, updated by set_block
+        self.frontier = set()
+        # Squares mapped from readings taken while driving, see scan_neighbours
+        self.moving_readings = set()
         self.instr_queue = queue.Queue()
+        # Search arrays allocated once and reused by every path search
+        self.workspace = search.Search_workspace(
+            self.map.width, self.map.height, DRIVE_COST, TURN_COST)
         self.mapping = False
         self.paused = False
         self.verbose = True
@@ -74,11 +100,13 @@ class Autopilot:
         elif current_y > next_y:
             return Compass.NORTH
 
-    # Generate list of instructions from path
+    # Generate list of instructions from path. Queue entries are
+    # (instruction, n), squares in a straight line are one (DRIVE, n)
     def make_instructions_from_path(self, path):
 
         current_heading = self.heading
         current_coordinate = path.pop(0)
+        squares = 0
 
         while len(path):
 
@@ -91,165 +119,90 @@ class Autopilot:
                 current_x, next_x, current_y, next_y)
 
             if next_heading != current_heading:
-                if next_heading == Compass.NORTH:
-                    self.instr_queue.put(Instruction.ROTATE_NORTH)
-                elif next_heading == Compass.WEST:
-                    self.instr_queue.put(Instruction.ROTATE_WEST)
-                elif next_heading == Compass.SOUTH:
-                    self.instr_queue.put(Instruction.ROTATE_SOUTH)
-                elif next_heading == Compass.EAST:
-                    self.instr_queue.put(Instruction.ROTATE_EAST)
+                if squares:
+                    self.instr_queue.put((Instruction.DRIVE, squares))
+                    squares = 0
+                self.instr_queue.put((ROTATE_INSTRUCTIONS[next_heading], 1))
 
             current_heading = next_heading
 
-            self.instr_queue.put(Instruction.DRIVE)
+            squares += 1
             current_coordinate = next_coordinate
 
-    # Scan neightbours
-    def scan_neighbours(self, sensor_data):
+        if squares:
+            self.instr_queue.put((Instruction.DRIVE, squares))
+
+    # Scan neightbours. If moving, the readings were taken while driving.
+    # They do not replace standing scans, and any later reading of the
+    # square replaces them so a noisy reading is corrected on the next pass
+    def scan_neighbours(self, sensor_data, moving=False):
         ir_front = sensor_data[0]
         ir_left = sensor_data[1]
         ir_right = sensor_data[2]
 
-        ret = []
         coordinate_front = self.pos[0] + \
             self.heading.value[0], self.pos[1] + self.heading.value[1]
         coordinate_left = self. get_coordinate_left()
         coordinate_right = self.get_coordinate_right()
 
-        # Right
-        if ir_right >= WALL_DETECTION_THRESHOLD:
-            ret.append(coordinate_right)
-            self.map[coordinate_right[1]
-                     ][coordinate_right[0]] = Block_type.EMPTY
-            self.server.put_empty(coordinate_right)
-        else:
-            self.map[coordinate_right[1]
-                     ][coordinate_right[0]] = Block_type.WALL
-            self.server.put_wall(coordinate_right)
-
-        # Left
-        if ir_left >= WALL_DETECTION_THRESHOLD:
-            ret.append(coordinate_left)
-            self.map[coordinate_left[1]][coordinate_left[0]] = Block_type.EMPTY
-            self.server.put_empty(coordinate_left)
-        else:
-            self.map[coordinate_left[1]][coordinate_left[0]] = Block_type.WALL
-            self.server.put_wall(coordinate_left)
-
-        # Front. Add last for "Forward first search"
-        if ir_front >= WALL_DETECTION_THRESHOLD:
-            ret.append(coordinate_front)
-            self.map[coordinate_front[1]
-                     ][coordinate_front[0]] = Block_type.EMPTY
-            self.server.put_empty(coordinate_front)
-        else:
-            self.map[coordinate_front[1]
-                     ][coordinate_front[0]] = Block_type.WALL
-            self.server.put_wall(coordinate_front)
+        # Right, left and front
+        for coordinate, distance in [(coordinate_right, ir_right),
+                                     (coordinate_left, ir_left),
+                                     (coordinate_front, ir_front)]:
+            if moving:
+                if self.map.get(coordinate) != grid.UNKNOWN \
+                        and coordinate not in self.moving_readings:
+                    continue
+                self.moving_readings.add(coordinate)
+            else:
+                self.moving_readings.discard(coordinate)
 
+            if distance >= WALL_DETECTION_THRESHOLD:
+                self.set_block(coordinate, Block_type.EMPTY)
+                self.server.put_empty(coordinate)
+            else:
+                self.set_block(coordinate, Block_type.WALL)
+                self.server.put_wall(coordinate)
+
+    # Set block type of a square in map. Only the square and its neighbours
+    # can enter or leave the frontier
+    def set_block(self, pos, block):
+        self.map.set(pos, block.value)
+
+        self.update_frontier(pos)
+        for offset in HEADING_OFFSETS:
+            neighbour = pos[0] + offset[0], pos[1] + offset[1]
+            if self.map.in_grid(neighbour):
+                self.update_frontier(neighbour)
+
+    def update_frontier(self, pos):
+        if self.map.get(pos) == grid.EMPTY and self.map.has_unknown_neighbour(pos):
+            self.frontier.add(pos)
+        else:
+            self.frontier.discard(pos)
 
-        return ret
     # Find fastest path
 
     def find_path(self, end_pos):
 
-        bfs_path = self.bfs(self.map, self.pos, end_pos)
-        # a_star_path = self.a_star_least_turns(self.map,self.pos,end_pos)
-
-        bfs_length = self.path_length_with_turns(bfs_path)
-        # a_start_length = self.path_length_with_turns(a_star_path)
-
-        # Compare BFS and A* to get the fastest path (the one with the least amount of turns)
-        # if a_start_length <= bfs_length:
-        #    return a_star_path
-
-        return bfs_path
-
-    # Heuristic for A* to get least amount of turns
-    def heuristic(self, node, end, current_direction, next_direction=None):
-
-        if current_direction is None:
-            return abs(node[0] - end[0]) + abs(node[1] - end[1])
-
-        turns = 7 if next_direction != current_direction else 0
-        return turns + abs(node[0] - end[0]) + abs(node[1] - end[1])
-
-    def a_star_least_turns(self, grid, start, end):
-        priority_queue = [(0, start, self.heading, [])]  # Init prio queue
-        visited = set()  # Init visited set
-
-        # Get width and length of grid
-        width = len(grid[0])
-        height = len(grid)
-
-        while len(priority_queue):
-            total_cost, current_node, current_direction, path = heapq.heappop(priority_queue)  # Get most prio elem
-
-            # Check if att end
-            if current_node == end:
-                return path + [current_node]
-
-            # Check if already visited
-            if current_node in visited:
-                continue
-
-            # Add to visited
-            visited.add(current_node)
-
-            x, y = current_node
-
-            # Loop through neighbours
-            for adjacent_x, adjacent_y in [(x + 1, y), (x - 1, y), (x, y + 1), (x, y - 1)]:
+        # A* over (square, heading) gives the path that is fastest with
+        # respect to turns, same cost as path_length_with_turns
+        return self.a_star_least_turns(self.map, self.pos, end_pos, self.heading)
 
-                # If in grid, is empty and not in visited calculate new direction, new path, cost and add to prio queue
-                if (
-                    0 <= adjacent_x and adjacent_x < width
-                    and 0 <= adjacent_y and adjacent_y < height
-                    and grid[adjacent_y][adjacent_x] == Block_type.EMPTY
-                    and (adjacent_x, adjacent_y) not in visited
-                ):
-                    new_direction = self.get_compass_from_value(
-                        (y - adjacent_y, x - adjacent_x))
-                    new_path = path + [current_node]
-                    cost = len(new_path)/2 + self.heuristic((adjacent_x,
-                                                             adjacent_y), end, current_direction, new_direction)
-                    heapq.heappush(
-                        priority_queue, (cost, (adjacent_x, adjacent_y), new_direction, new_path))
+    # A* over (square, heading). Driving a square costs DRIVE_COST and
+    # changing heading costs TURN_COST, same as path_length_with_turns
+    def a_star_least_turns(self, grid, start, end, heading):
 
-        return None
+        self.workspace.load(grid, Block_type.EMPTY.value)
 
-    def bfs(self, grid: list, start: tuple, end: tuple):
+        return self.workspace.a_star(start, end, HEADINGS.index(heading))
 
-        # Init queue
-        bfs_queue = queue.Queue()
-        bfs_queue.put([start])
+    # Path with fewest squares
+    def bfs(self, grid: grid.Grid, start: tuple, end: tuple):
 
-        # Init visited set
-        visited = set([start])
+        self.workspace.load(grid, Block_type.EMPTY.value)
 
-        # Get width and length of grid
-        width = len(grid[0])
-        height = len(grid)
-
-        while not bfs_queue.empty():
-
-            # Get first item in queue and last pos of that item
-            path = bfs_queue.get()
-            x, y = path[-1]
-
-            if (x, y) == end:  # Check if att end
-                return path
-
-            # Loop through neighbours to current pos
-            for adjacent_x, adjacent_y in [(x+1, y), (x-1, y), (x, y+1), (x, y-1)]:
-
-                # If within grid, empty and not visited and to queue and set visited
-                if 0 <= adjacent_x < width and 0 <= adjacent_y < height \
-                        and grid[adjacent_y][adjacent_x] == Block_type.EMPTY \
-                        and (adjacent_x, adjacent_y) not in visited:
-                    bfs_queue.put(path + [(adjacent_x, adjacent_y)])
-                    visited.add((adjacent_x, adjacent_y))
+        return self.workspace.bfs(start, end)
 
     # Calculate the true length of a path with respect to turns
 
@@ -272,11 +225,11 @@ class Autopilot:
 
             # If we have to turn add extra
             if next_heading != current_heading:
-                length += 1.5
+                length += TURN_COST
 
             current_heading = next_heading
             current_coordinate = next_coordinate
-            length += 1.125
+            length += DRIVE_COST
 
         return length
 
@@ -301,21 +254,8 @@ class Autopilot:
     # Check if a visit is needed
     def is_visit_needed(self, pos):
 
-        # Get coordinates around a pos
-        west_coord = self.get_coordinate_compass(Compass.WEST, pos)
-        east_coord = self.get_coordinate_compass(Compass.EAST, pos)
-        north_coord = self.get_coordinate_compass(Compass.NORTH, pos)
-        south_coord = self.get_coordinate_compass(Compass.SOUTH, pos)
-
-        # If any of the squares around the pos is unknown a visit is needed
-        if self.map[west_coord[1]][west_coord[0]] == Block_type.UNKNOWN \
-                or self.map[east_coord[1]][east_coord[0]] == Block_type.UNKNOWN \
-                or self.map[north_coord[1]][north_coord[0]] == Block_type.UNKNOWN \
-                or self.map[south_coord[1]][south_coord[0]] == Block_type.UNKNOWN:
-            return True
-
-        # Else it is not needed
-        return False
+        # Empty squares with an unknown neighbour need a visit
+        return pos in self.frontier
 
     # Get clockwise heading depending on current heading
 
@@ -340,14 +280,49 @@ class Autopilot:
         elif self.heading == Compass.EAST:
             return Compass.NORTH
 
-    # Drive forward one square
-    def drive(self):
+    # Drive forward n squares in one motion
+    def drive(self, n=1):
+        if SCAN_WHILE_DRIVING:
+            squares = self.motor.drive_forward(n, self.enter_square, self.pass_centre)
+        else:
+            squares = self.motor.drive_forward(n, self.enter_square)
+
+        # Stopped short by the fail safe, the rest of the path was planned
+        # from the wrong square. Drop it and replan from where the robot is
+        if squares < n:
+            self.log("Drive stopped after " + str(squares) + " of " + str(n) + " squares")
+            self.instr_queue = queue.Queue()
+
+    # Called by the motor when the robot has crossed into the next square
+    def enter_square(self):
         new_pos = self.get_coordinate_front()
-        self.motor.drive_forward(1)
+
+        # The robot is in the square, whatever was read of it
+        self.moving_readings.discard(new_pos)
+        if self.map.get(new_pos) != grid.EMPTY:
+            self.set_block(new_pos, Block_type.EMPTY)
+
         self.server.put_empty(self.pos)
         self.server.put_robot(new_pos)
         self.pos = new_pos
 
+    # Called by the motor at the centre of every square driven. Returns True
+    # to drive one more square, at the last square of a drive if the square
+    # in front needs a visit. Nothing is queued then, and the frontier
+    # search would pick that square anyway since it needs no turn
+    def pass_centre(self, ir_data, last):
+        self.scan_neighbours(ir_data, moving=True)
+
+        if not last or not self.mapping or not self.instr_queue.empty():
+            return False
+
+        front = self.get_coordinate_front()
+        if self.map.get(front) != grid.EMPTY or not self.is_visit_needed(front):
+            return False
+
+        self.server.put_path(front)
+        return True
+
     # Rotate to north
     def rotate_north(self):
         if self.heading == Compass.WEST:
@@ -392,11 +367,11 @@ class Autopilot:
 
         self.heading = Compass.EAST
 
-    # Execute an instruction
+    # Execute an instruction, n is the number of squares for DRIVE
 
-    def execute_instr(self, instr):
+    def execute_instr(self, instr, n=1):
         if instr == Instruction.DRIVE:
-            self.drive()
+            self.drive(n)
         elif instr == Instruction.ROTATE_NORTH:
             self.rotate_north()
         elif instr == Instruction.ROTATE_WEST:
@@ -417,83 +392,70 @@ class Autopilot:
         # If instruction in queue execute instruction and return
         if not self.instr_queue.empty():
             self.log("Executing instruction")
-            self.execute_instr(self.instr_queue.get())
+            self.execute_instr(*self.instr_queue.get())
             return
 
-        # Scan neighbours and add open to stack if not visited
+        # Scan neighbours, the frontier is updated with the map
         self.log("Scanning neighbours")
-        open_neighbours = self.scan_neighbours(sensor_data)
-
-        if self.pos == START_POS and not len(open_neighbours):
-            coordinate_south = self.get_coordinate_compass(
-                Compass.SOUTH, self.pos)
-            if self.map[coordinate_south[0]][coordinate_south[1]] == Block_type.UNKNOWN:
-                self.instr_queue.put(Instruction.ROTATE_SOUTH)
-            return
+        self.scan_neighbours(sensor_data)
 
-        for n in open_neighbours:
-            if n not in self.visited:
-                self.stack.append(n)
+        if not self.plan_frontier():
+            self.finish_mapping()
 
-        # Add current pos to visited
-        self.visited.add(self.pos)
+    # No visits needed, return to start and finish mapping
+    def finish_mapping(self):
 
-        # If stack empty, we assuma mapping is done
-        self.log("Check stack")
-        if not len(self.stack):
+        self.log("Mapping done")
 
-            self.log("Mapping done")
+        # If not at start return to start
+        if self.pos != START_POS:
 
-            # If not at start return to start
-            if self.pos != START_POS:
+            self.log("Returning to start")
+            path = self.find_path(START_POS)
+            self.send_path(path)
+            self.make_instructions_from_path(path)
 
-                self.log("Returning to start")
-                path = self.find_path(START_POS)
-                self.send_path(path)
-                self.make_instructions_from_path(path)
+        elif self.heading != Compass.NORTH:
 
-            elif self.heading != Compass.NORTH:
+            # Put rotate north to queue after start pos is reached
+            # to make sure that start pos is searched (no IR-sensor in back)
+            self.instr_queue.put((Instruction.ROTATE_NORTH, 1))
 
-                # Put rotate north to queue after start pos is reached
-                # to make sure that start pos is searched (no IR-sensor in back)
-                self.instr_queue.put(Instruction.ROTATE_NORTH)
-
-            else:
-
-                self.mapping = False  # Start position has been searched, done!
-
-            return
+        else:
 
-        self.log("Getting next")
+            self.mapping = False  # Start position has been searched, done!
 
-        # If stack not empty handle stack
-        while len(self.stack):
+    # Plan next move with one search from current position to the closest
+    # square where a visit is needed. Returns False if there is none
+    def plan_frontier(self):
 
-            self.log(self.stack)
+        # Square behind is unknown (only at start, no IR-sensor in back),
+        # turning is cheaper than driving somewhere else
+        for heading in HEADINGS:
+            neighbour = self.pos[0] + heading.value[0], self.pos[1] + heading.value[1]
+            if self.map.get(neighbour) == grid.UNKNOWN:
+                self.instr_queue.put((ROTATE_INSTRUCTIONS[heading], 1))
+                return True
 
-            # Get next pos
-            nextpos = self.stack.pop()
+        # No empty square with an unknown neighbour left, mapping is done
+        if not self.frontier:
+            return False
 
-            # If next pos is not visited
-            if nextpos not in self.visited:
+        path = self.find_frontier_path()
+        if path is None:
+            return False
 
-                # check if a visit is needed
-                if self.is_visit_needed(nextpos):
+        self.send_path(path)
+        self.make_instructions_from_path(path)
+        return True
 
-                    # if neeeded find path and make instructions
-                    path = self.find_path(nextpos)
-                    self.send_path(path)
-                    self.make_instructions_from_path(path)
+    # Fastest path to the closest square where a visit is needed
+    def find_frontier_path(self):
 
-                    # Make sure copies of next pos is removed from the stack
-                    if nextpos in self.stack:
-                        self.stack.remove(nextpos)
+        self.workspace.load(self.map, grid.EMPTY)
 
-                    # Break from the loop
-                    break
-                else:
-                    # if not needed add to visit instantly
-                    self.visited.add(nextpos)
+        return self.workspace.nearest(
+            self.pos, HEADINGS.index(self.heading), self.is_visit_needed)
 
     def get_pos(self):
 
@@ -534,11 +496,11 @@ class Autopilot:
     def start_mapping(self):
 
         self.pos = START_POS
-        self.stack = []
         self.heading = Compass.NORTH
-        self.map = [[Block_type.UNKNOWN for x in range(17)] for y in range(17)]
-        self.map[START_POS[1]][START_POS[0]] = Block_type.EMPTY
-        self.visited.clear()
+        self.map.fill(grid.UNKNOWN)
+        self.frontier.clear()
+        self.moving_readings.clear()
+        self.set_block(START_POS, Block_type.EMPTY)
         self.instr_queue = queue.Queue()
 
         self.server.init_map(self.map, self.pos)
@@ -0,0 +1,306 @@
+'''
+ bench.py
+
+ Benchmark of exploration runs. Runs the Autopilot against a corpus of
+ 17x17 mazes through a fake motor that moves one square per drive, and
+ reports instructions, estimated physical time (same costs as
+ Autopilot.path_length_with_turns), planner CPU time and peak memory.
+
+ Usage: python bench.py [--output results.json] [--compare old.json] [--check]
+   --check: compare Autopilot.frontier with a full scan of the map every cycle
+'''
+
+import argparse
+import json
+import random
+import sys
+import time
+import tracemalloc
+import auto
+import grid
+import simulator
+
+MAZE_SIZE = 17
+CORPUS_SEEDS = range(10)
+MAX_CYCLES = 20000
+IR_WALL = 10  # cm, reading with a wall in the neighbouring square
+IR_OPEN = 255  # Reading with nothing in range
+DEFAULT_OUTPUT = "bench_results.json"
+
+HEADING_LEFT = {
+    auto.Compass.NORTH: auto.Compass.WEST,
+    auto.Compass.WEST: auto.Compass.SOUTH,
+    auto.Compass.SOUTH: auto.Compass.EAST,
+    auto.Compass.EAST: auto.Compass.NORTH,
+}
+HEADING_RIGHT = {value: key for key, value in HEADING_LEFT.items()}
+
+
+# Generate a maze with corridors on even squares around START_POS.
+# loop_factor is the chance of opening an extra wall to create loops
+def generate_maze(seed, loop_factor=0.1):
+    rng = random.Random(seed)
+    grid = [['#'] * MAZE_SIZE for _ in range(MAZE_SIZE)]
+    nodes = range(2, MAZE_SIZE - 2, 2)
+
+    # Randomized depth first search from start
+    stack = [auto.START_POS]
+    grid[auto.START_POS[0]][auto.START_POS[1]] = '.'
+
+    while stack:
+        y, x = stack[-1]
+        neighbours = [(y + dy, x + dx) for dy, dx in [(-2, 0), (2, 0), (0, -2), (0, 2)]
+                      if y + dy in nodes and x + dx in nodes and grid[y + dy][x + dx] == '#']
+
+        if not neighbours:
+            stack.pop()
+            continue
+
+        next_y, next_x = rng.choice(neighbours)
+        grid[(y + next_y) // 2][(x + next_x) // 2] = '.'
+        grid[next_y][next_x] = '.'
+        stack.append((next_y, next_x))
+
+    # Open walls between two corridors to make loops
+    for y in range(2, MAZE_SIZE - 2):
+        for x in range(2, MAZE_SIZE - 2):
+            if grid[y][x] == '#' and (y % 2) != (x % 2) and rng.random() < loop_factor:
+                grid[y][x] = '.'
+
+    return [''.join(row) for row in grid]
+
+
+# Open room, worst case for the number of equally long paths
+def open_maze():
+    return ['#' * MAZE_SIZE if y < 3 or y > MAZE_SIZE - 4
+            else '###' + '.' * (MAZE_SIZE - 6) + '###' for y in range(MAZE_SIZE)]
+
+
+# Mazes to benchmark, name and rows
+def get_corpus():
+    corpus = [("default", simulator.DEFAULT_MAZE), ("open", open_maze())]
+
+    for seed in CORPUS_SEEDS:
+        corpus.append(("maze_" + str(seed), generate_maze(seed)))
+        corpus.append(("loops_" + str(seed), generate_maze(seed, 0.4)))
+
+    return corpus
+
+
+# Motor that moves one square per drive and a quarter turn per turn
+class Fake_motor:
+    def __init__(self, maze):
+        self.maze = maze
+        self.pos = auto.START_POS
+        self.heading = auto.Compass.NORTH
+        self.drives = 0
+        self.squares = 0
+        self.turns = 0
+        self.quarter_turns = 0
+
+    def is_wall(self, pos):
+        return self.maze[pos[0]][pos[1]] == '#'
+
+    def get_neighbour(self, heading):
+        return self.pos[0] + heading.value[0], self.pos[1] + heading.value[1]
+
+    # IR readings (front, left, right) in the current square
+    def read_ir(self):
+        return tuple(IR_WALL if self.is_wall(self.get_neighbour(heading)) else IR_OPEN
+                     for heading in [self.heading, HEADING_LEFT[self.heading],
+                                     HEADING_RIGHT[self.heading]])
+
+    def drive_forward(self, n, on_square=None, on_centre=None):
+        self.drives += 1
+        square = 0
+
+        while square < n:
+            next_pos = self.get_neighbour(self.heading)
+            if self.is_wall(next_pos):
+                raise RuntimeError("Drove into wall at " + str(next_pos))
+            self.pos = next_pos
+            self.squares += 1
+            square += 1
+            if on_square is not None:
+                on_square()
+            if on_centre is not None and on_centre(self.read_ir(), square == n) and square == n:
+                n += 1
+
+        return square
+
+    def turn_left(self, n):
+        self.turns += 1
+        self.quarter_turns += n
+        for _ in range(n):
+            self.heading = HEADING_LEFT[self.heading]
+
+    def turn_right(self, n):
+        self.turns += 1
+        self.quarter_turns += n
+        for _ in range(n):
+            self.heading = HEADING_RIGHT[self.heading]
+
+    def stop(self):
+        pass
+
+    def set_movement(self, direction, n=0, n1=0):
+        pass
+
+
+# Autopilot counting executed instructions and time spent planning
+class Bench_autopilot(auto.Autopilot):
+    def __init__(self, motor, server):
+        super().__init__(motor, server)
+        self.verbose = False
+        self.drive_instructions = 0
+        self.rotate_instructions = 0
+        self.planner_time = 0.0
+
+    def execute_instr(self, instr, n=1):
+        if instr == auto.Instruction.DRIVE:
+            self.drive_instructions += 1
+        else:
+            self.rotate_instructions += 1
+
+        super().execute_instr(instr, n)
+
+    def find_path(self, end_pos):
+        start_time = time.process_time()
+        path = super().find_path(end_pos)
+        self.planner_time += time.process_time() - start_time
+
+        return path
+
+    def find_frontier_path(self):
+        start_time = time.process_time()
+        path = super().find_frontier_path()
+        self.planner_time += time.process_time() - start_time
+
+        return path
+
+    # Compare the incrementally updated frontier with a full scan of the map
+    def check_frontier(self):
+        expected = {(x, y) for x in range(self.map.width) for y in range(self.map.height)
+                    if self.map.get((x, y)) == grid.EMPTY
+                    and self.map.has_unknown_neighbour((x, y))}
+        if expected != self.frontier:
+            raise RuntimeError("Frontier differs from map at " +
+                               str(sorted(expected ^ self.frontier)))
+
+
+# Map one maze, return autopilot, motor, completed cycles and CPU time.
+# If check, the frontier is checked after every cycle
+def explore(maze, check=False):
+    motor = Fake_motor(maze)
+    autopilot = Bench_autopilot(motor, simulator.Null_server())
+    autopilot.start_mapping()
+
+    cycles = 0
+    start_time = time.process_time()
+
+    while autopilot.is_mapping() and cycles < MAX_CYCLES:
+        autopilot.cycle_autopilot(motor.read_ir())
+        cycles += 1
+        if check:
+            autopilot.check_frontier()
+
+    cpu_time = time.process_time() - start_time
+
+    return autopilot, motor, cycles, cpu_time
+
+
+# Benchmark one maze, one timed run and one run measuring memory
+def run_maze(name, maze):
+    start_time = time.perf_counter()
+    autopilot, motor, cycles, cpu_time = explore(maze)
+    wall_time = time.perf_counter() - start_time
+
+    tracemalloc.start()
+    explore(maze)
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    estimated_time = motor.squares * auto.DRIVE_COST + motor.turns * auto.TURN_COST
+
+    return {
+        "maze": name,
+        "done": not autopilot.is_mapping() and motor.pos == auto.START_POS,
+        "cycles": cycles,
+        "drive_instructions": autopilot.drive_instructions,
+        "rotate_instructions": autopilot.rotate_instructions,
+        "squares": motor.squares,
+        "turns": motor.turns,
+        "quarter_turns": motor.quarter_turns,
+        "estimated_time": round(estimated_time, 3),
+        "cpu_time": round(cpu_time, 6),
+        "planner_time": round(autopilot.planner_time, 6),
+        "wall_time": round(wall_time, 6),
+        "peak_memory": peak_memory,
+    }
+
+
+# Sum of all numeric results
+def get_total(results):
+    total = {"maze": "total", "done": all(result["done"] for result in results)}
+
+    for key, value in results[0].items():
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            total[key] = round(sum(result[key] for result in results), 6)
+    total["peak_memory"] = max(result["peak_memory"] for result in results)
+
+    return total
+
+
+# Print relative change of every metric against an earlier result file
+def compare(results, path):
+    with open(path) as f:
+        old_results = {result["maze"]: result for result in json.load(f)["results"]}
+
+    for result in results:
+        old = old_results.get(result["maze"])
+        if old is None:
+            continue
+
+        changes = []
+        for key, value in result.items():
+            old_value = old.get(key)
+            if isinstance(value, bool) or not isinstance(value, (int, float)) \
+                    or not old_value or value == old_value:
+                continue
+            changes.append(key + " " + format((value - old_value) / old_value, "+.1%"))
+
+        print(result["maze"].ljust(10), ", ".join(changes) or "no change")
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark exploration runs")
+    parser.add_argument("--output", default=DEFAULT_OUTPUT,
+                        help="JSON file to write results to")
+    parser.add_argument("--compare", help="earlier JSON result file to compare with")
+    parser.add_argument("--check", action="store_true",
+                        help="check the autopilot frontier every cycle, in an extra run")
+    args = parser.parse_args()
+
+    results = []
+    for name, maze in get_corpus():
+        if args.check:
+            explore(maze, check=True)
+        result = run_maze(name, maze)
+        results.append(result)
+        print(name.ljust(10), "done:", result["done"], "cycles:", result["cycles"],
+              "drive:", result["drive_instructions"], "rotate:", result["rotate_instructions"],
+              "est:", result["estimated_time"], "cpu:", result["cpu_time"])
+
+    results.append(get_total(results))
+
+    with open(args.output, "w") as f:
+        json.dump({"python": sys.version.split()[0], "results": results}, f, indent=2)
+
+    if args.compare:
+        compare(results, args.compare)
+
+    return 0
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,130 @@
+import math
+import heading
+
+WALL_DISTANCE = 20  # cm from cell centre line to a side wall
+SIDE_SENSOR_OFFSET = 9  # cm from robot centre to the side IR sensors
+MAX_WALL_READING = 20  # cm, longer side readings are not a wall next to the robot
+MAX_SAMPLE_GAP = heading.MAX_SAMPLE_GAP
+
+# Kalman filter noise, variances in cm^2 and rad^2
+IR_VARIANCE = 1.0  # Side IR reading
+OFFSET_NOISE = 0.02  # Offset process noise per cm driven
+HEADING_NOISE = 0.0005  # Heading process noise per second, gyro drift
+START_OFFSET_VARIANCE = 100.0  # Offset unknown until a wall is seen
+START_HEADING_VARIANCE = 0.01  # About 6 degrees after a turn
+GATE = 3.0  # Readings further than GATE standard deviations are rejected
+MAX_REJECTS = 10  # Consecutive rejected readings before the offset is reset
+SPEED_GAIN = 0.2  # Low pass gain of the speed estimate
+
+
+# Estimates the lateral offset from the corridor centre line and the heading
+# relative to the corridor while driving straight. A two state Kalman filter:
+# heading is predicted from the gyro, offset from the odometer distance and
+# the heading, and both are corrected by the side IR readings. Single noisy
+# readings and wall openings are rejected by an innovation gate.
+# Offset is in cm and heading in radians, both positive to the left.
+class Drive_filter:
+    def __init__(self, sensor, gyro_units_per_radian, cm_per_tick):
+        self.sensor = sensor
+        self.gyro_units_per_radian = gyro_units_per_radian
+        self.cm_per_tick = cm_per_tick
+        self.bias = float(heading.GYRO_OFFSET)
+        self.reset()
+
+    # Start a new drive, offset unknown and heading along the corridor
+    def reset(self, bias=None):
+        if bias is not None:
+            self.bias = bias
+
+        self.offset = 0.0
+        self.heading = 0.0
+        self.p = [[START_OFFSET_VARIANCE, 0.0], [0.0, START_HEADING_VARIANCE]]
+        self.speed = 0.0
+        self.last_time = None
+        self.last_rate = 0.0
+        self.last_odometer = None
+        self.rejects = 0
+        self.data = None
+
+    # Filter all new samples, return the latest sensor data
+    def update(self):
+        for timestamp, data in heading.read_new_samples(self.sensor, self.last_time):
+            self.add_sample(timestamp, data)
+
+        return self.data
+
+    def add_sample(self, timestamp, data):
+        rate = (data.gyro - self.bias) / self.gyro_units_per_radian
+
+        if self.last_time is not None:
+            dt = min(timestamp - self.last_time, MAX_SAMPLE_GAP)
+            distance = (data.odometer - self.last_odometer) * self.cm_per_tick
+            self.predict((self.last_rate + rate) / 2 * dt, distance, dt)
+
+            if dt > 0:
+                self.speed += SPEED_GAIN * (distance / dt - self.speed)
+
+        self.last_time = timestamp
+        self.last_rate = rate
+        self.last_odometer = data.odometer
+        self.data = data
+
+        cos_heading = math.cos(self.heading)
+        if data.ir_left < MAX_WALL_READING:
+            self.correct(WALL_DISTANCE - (data.ir_left + SIDE_SENSOR_OFFSET) * cos_heading)
+        if data.ir_right < MAX_WALL_READING:
+            self.correct((data.ir_right + SIDE_SENSOR_OFFSET) * cos_heading - WALL_DISTANCE)
+
+    # Rotate by rotation radians and drive distance cm
+    def predict(self, rotation, distance, dt):
+        mid_heading = self.heading + rotation / 2
+        self.offset += distance * math.sin(mid_heading)
+        self.heading += rotation
+
+        # P = F P F' + Q with F = [[1, f], [0, 1]]
+        f = distance * math.cos(mid_heading)
+        p = self.p
+        p01 = p[0][1] + f * p[1][1]
+        p[0][0] += f * (p[1][0] + p01) + OFFSET_NOISE * abs(distance)
+        p[0][1] = p01
+        p[1][0] = p01
+        p[1][1] += HEADING_NOISE * dt
+
+    # Correct with a measured offset
+    def correct(self, measured):
+        p = self.p
+        innovation = measured - self.offset
+        s = p[0][0] + IR_VARIANCE
+
+        if innovation * innovation > GATE * GATE * s:
+            self.rejects += 1
+            if self.rejects < MAX_REJECTS:
+                return
+
+            # Estimate is off, start over from the reading
+            self.offset = measured
+            p[0][0] = IR_VARIANCE
+            p[0][1] = p[1][0] = 0.0
+            self.rejects = 0
+            return
+
+        self.rejects = 0
+        k0 = p[0][0] / s
+        k1 = p[1][0] / s
+        self.offset += k0 * innovation
+        self.heading += k1 * innovation
+
+        p00, p01, p11 = p[0][0], p[0][1], p[1][1]
+        p[0][0] = p00 - k0 * p00
+        p[0][1] = p[1][0] = p01 - k0 * p01
+        p[1][1] = p11 - k1 * p01
+
+    def get_offset(self):
+        return self.offset
+
+    def get_heading(self):
+        return self.heading
+
+    # Sideways speed in cm/s, positive to the left
+    def get_offset_rate(self):
+        return self.speed * math.sin(self.heading)
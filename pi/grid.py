@@ -0,0 +1,39 @@
+# Block codes stored in the grid, same values as auto.Block_type
+UNKNOWN = 0
+EMPTY = 1
+WALL = 2
+
+
+# Occupancy grid stored as one byte per square in a flat bytearray.
+# Squares are (x, y) tuples, index is y * width + x, same as Autopilot.map.
+class Grid:
+    def __init__(self, width, height, fill=UNKNOWN):
+        self.width = width
+        self.height = height
+        self.cells = bytearray([fill]) * (width * height)
+
+    def in_grid(self, pos):
+        return 0 <= pos[0] < self.width and 0 <= pos[1] < self.height
+
+    def get(self, pos):
+        return self.cells[pos[1] * self.width + pos[0]]
+
+    def set(self, pos, code):
+        self.cells[pos[1] * self.width + pos[0]] = code
+
+    # Set every square to code
+    def fill(self, code):
+        self.cells[:] = bytes([code]) * len(self.cells)
+
+    # Check if any of the four neighbours of pos is UNKNOWN
+    def has_unknown_neighbour(self, pos):
+        cells, width = self.cells, self.width
+        index = pos[1] * width + pos[0]
+
+        return (pos[0] > 0 and cells[index - 1] == UNKNOWN) \
+            or (pos[0] < width - 1 and cells[index + 1] == UNKNOWN) \
+            or (pos[1] > 0 and cells[index - width] == UNKNOWN) \
+            or (pos[1] < self.height - 1 and cells[index + width] == UNKNOWN)
+
+    def to_bytes(self):
+        return bytes(self.cells)
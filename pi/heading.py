@@ -0,0 +1,93 @@
+import time
+
+GYRO_OFFSET = 127  # Raw gyro value when not rotating, start value of bias
+BIAS_WINDOW = 0.2  # Seconds of samples used to estimate bias
+BIAS_SAMPLES = 10  # Samples read to estimate bias without a sampler
+STATIONARY_SPREAD = 2  # Max raw value spread of samples taken standing still
+MAX_BIAS_ERROR = 10  # Max distance of bias from GYRO_OFFSET
+BIAS_GAIN = 0.5  # Weight of a new bias estimate
+MAX_SAMPLE_GAP = 0.1  # Seconds, longer gaps are integrated as this long
+
+
+# New (timestamp, Sensor_data) samples after last_time, waits for at least
+# one. Only the latest sample if last_time is None. Reads the sensor
+# directly if it is not a sampler.Sampler
+def read_new_samples(sensor, last_time=None):
+    if not hasattr(sensor, "samples"):
+        return [(time.monotonic(), sensor.read_snapshot())]
+
+    sensor.wait_for_sample(last_time)
+    samples = list(sensor.samples)
+
+    if last_time is None:
+        samples = samples[-1:]
+
+    return [(sample.timestamp, sample.data) for sample in samples
+            if last_time is None or sample.timestamp > last_time]
+
+
+# Integrates the gyro to a heading. Positive rotation is to the left, in
+# raw gyro units * seconds like TURN_COEFF. Uses every sample of a
+# sampler.Sampler at its fixed rate with the sample timestamps, or reads a
+# sensormodul.Sensor directly. Integration is trapezoidal and the bias is
+# estimated from samples taken while standing still.
+class Heading_integrator:
+    def __init__(self, sensor):
+        self.sensor = sensor
+        self.bias = float(GYRO_OFFSET)
+        self.heading = 0.0
+        self.last_time = None
+        self.last_rate = 0.0
+
+    # Start integrating from heading 0 at the next sample
+    def reset(self):
+        self.heading = 0.0
+        self.last_time = None
+        self.last_rate = 0.0
+
+    def uses_sampler(self):
+        return hasattr(self.sensor, "samples")
+
+    # New (timestamp, gyro) samples, waits for at least one
+    def read_samples(self):
+        return [(timestamp, data.gyro)
+                for timestamp, data in read_new_samples(self.sensor, self.last_time)]
+
+    # Integrate all new samples, return heading
+    def update(self):
+        for timestamp, gyro in self.read_samples():
+            rate = gyro - self.bias
+
+            if self.last_time is not None:
+                dt = min(timestamp - self.last_time, MAX_SAMPLE_GAP)
+                self.heading += (self.last_rate + rate) / 2 * dt
+
+            self.last_time = timestamp
+            self.last_rate = rate
+
+        return self.heading
+
+    # Latest bias corrected rotation rate
+    def get_rate(self):
+        return self.last_rate
+
+    # Raw gyro values of the last moment, for bias estimation
+    def read_still_values(self):
+        if self.uses_sampler():
+            return [sample.data.gyro for sample in self.sensor.window(BIAS_WINDOW)]
+
+        return [self.sensor.read_snapshot().gyro for _ in range(BIAS_SAMPLES)]
+
+    # Update bias, call only while standing still. Values that look like
+    # rotation or a faulty gyro are ignored
+    def estimate_bias(self):
+        values = self.read_still_values()
+        if not values:
+            return self.bias
+
+        mean = sum(values) / len(values)
+        if max(values) - min(values) <= STATIONARY_SPREAD \
+                and abs(mean - GYRO_OFFSET) <= MAX_BIAS_ERROR:
+            self.bias += BIAS_GAIN * (mean - self.bias)
+
+        return self.bias
@@ -1,10 +1,136 @@
+'''
+ ir_conversion.py
+
+ Conversion of raw IR sensor values to cm. Every sensor has a calibration
+ curve distance = a / (raw + b) - c + offset, valid for raw values
+ min_raw..max_raw, that is precomputed into a 256 entry lookup table.
+ Curves are fit from recorded (raw, distance) pairs.
+
+ Usage: python ir_conversion.py calibration.json
+   calibration.json: {"ir_front": [[raw, cm], ...], "ir_left": ..., "ir_right": ...}
+'''
+
+import json
+import sys
+
+IR_MIN_RAW = 18  # Lower raw values are out of range, too far
+IR_MAX_RAW = 103  # Higher raw values are out of range, too close
+IR_TOO_FAR = 255
+IR_TOO_CLOSE = 0
+IR_LEFT_ERROR = 1.5  # Offset of left sensor with the default curve
+IR_SENSORS = ["ir_front", "ir_left", "ir_right"]
+
+# Values of b tried when fitting, a and c are solved for every b
+FIT_B_VALUES = [i / 10 for i in range(0, 301)]
+
+
 # Linearize ir-data and scale to cm
 def linearize_ir_data(val):
-    if val > 103:
-        return 0
-    if val < 18:
-        return 255
+    if val > IR_MAX_RAW:
+        return IR_TOO_CLOSE
+    if val < IR_MIN_RAW:
+        return IR_TOO_FAR
 
     r = 1/5.104*((2914/(val+5)) - 1)
 
     return round(r, 2)
+
+
+class Ir_calibration:
+    def __init__(self, a, b, c, offset=0.0, min_raw=IR_MIN_RAW, max_raw=IR_MAX_RAW):
+        self.a = a
+        self.b = b
+        self.c = c
+        self.offset = offset
+        self.min_raw = min_raw
+        self.max_raw = max_raw
+
+    def get_distance(self, raw):
+        if raw > self.max_raw:
+            return IR_TOO_CLOSE
+        if raw < self.min_raw:
+            return IR_TOO_FAR
+
+        return round(self.a / (raw + self.b) - self.c + self.offset, 2)
+
+    # Distance for every raw value 0..255
+    def make_table(self):
+        return [self.get_distance(raw) for raw in range(256)]
+
+    def to_dict(self):
+        return {"a": self.a, "b": self.b, "c": self.c, "offset": self.offset,
+                "min_raw": self.min_raw, "max_raw": self.max_raw}
+
+
+# Same curve as linearize_ir_data
+DEFAULT_CALIBRATION = Ir_calibration(2914 / 5.104, 5, 1 / 5.104)
+DEFAULT_CALIBRATIONS = {
+    "ir_front": DEFAULT_CALIBRATION,
+    "ir_left": Ir_calibration(2914 / 5.104, 5, 1 / 5.104, IR_LEFT_ERROR),
+    "ir_right": DEFAULT_CALIBRATION,
+}
+
+
+# Least squares fit of distance = a / (raw + b) - c. For a fixed b the
+# curve is linear in a and c, so those are solved exactly and b is searched
+def fit_calibration(pairs):
+    pairs = [(raw, distance) for raw, distance in pairs if IR_MIN_RAW <= raw <= IR_MAX_RAW]
+    if len(pairs) < 3:
+        raise ValueError("Need at least 3 calibration pairs in range")
+
+    best = None
+    for b in FIT_B_VALUES:
+        xs = [1 / (raw + b) for raw, _ in pairs]
+        ys = [distance for _, distance in pairs]
+        n = len(xs)
+        mean_x = sum(xs) / n
+        mean_y = sum(ys) / n
+        var_x = sum((x - mean_x) ** 2 for x in xs)
+        if var_x == 0:
+            continue
+
+        a = sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / var_x
+        c = a * mean_x - mean_y
+        error = sum((a * x - c - y) ** 2 for x, y in zip(xs, ys))
+
+        if best is None or error < best[0]:
+            best = (error, a, b, c)
+
+    if best is None:
+        raise ValueError("Calibration pairs have only one raw value")
+
+    return Ir_calibration(best[1], best[2], best[3])
+
+
+# Lookup tables of every sensor from calibrations
+def make_tables(calibrations=DEFAULT_CALIBRATIONS):
+    return {sensor: calibrations[sensor].make_table() for sensor in IR_SENSORS}
+
+
+DEFAULT_TABLES = make_tables()
+
+
+# Fit a calibration per sensor from a JSON file of (raw, distance) pairs,
+# sensors missing in the file keep the default calibration
+def load_calibrations(path):
+    with open(path) as f:
+        recorded = json.load(f)
+
+    calibrations = dict(DEFAULT_CALIBRATIONS)
+    for sensor in IR_SENSORS:
+        if sensor in recorded:
+            calibrations[sensor] = fit_calibration(recorded[sensor])
+
+    return calibrations
+
+
+def main() -> int:
+    calibrations = load_calibrations(sys.argv[1])
+    print(json.dumps({sensor: calibrations[sensor].to_dict() for sensor in IR_SENSORS},
+                     indent=2))
+
+    return 0
+
+
+if __name__ == '__main__':
+    main()
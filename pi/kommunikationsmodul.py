@@ -7,122 +7,234 @@
 # 0111, 0111, bak
 
 
-import smbus
+import select
 import socket
+import threading
 import time
-from io import StringIO
-import numpy as np
 import queue
-from auto import Block_type
+import protocol
 
 instr_set = ['fwd', 'back', 'left', 'right', 'fwd_right', 'fwd_left', 'stop']
 
+# Cell updates per frame, keeps payload within protocol.MAX_PAYLOAD
+MAX_CELLS_PER_FRAME = protocol.MAX_PAYLOAD // protocol.CELL_ABSOLUTE.size
 
+# Seconds between telemetry and map updates pushed to the external computer
+STREAM_PERIOD = 0.05
+
+# Seconds to wait for a connection before checking if the server is stopped
+ACCEPT_TIMEOUT = 1.0
+
+# Most cells with updates waiting to be sent. If more cells change before
+# the link catches up, the whole map is sent again instead
+MAX_DIRTY_CELLS = 1024
+
+
+# Bluetooth server running in its own thread. The control loop never waits
+# for the link: cycle_server only hands over the latest telemetry and
+# applies commands that the thread has received. The thread accepts and
+# reconnects clients, pushes telemetry and map updates every STREAM_PERIOD
+# and only builds new frames once the previous ones are sent, so a slow
+# link gets fewer and newer telemetry frames and only the latest state of
+# every changed cell instead of a growing backlog.
 class Server:
     def __init__(self, motor):
         self.motor = motor
         self.connection = None
         self.client = None
-        self.coord_data_queue = None
+        # Latest cell type of every (x, y) changed since last send
+        self.dirty_cells = {}
+        self.snapshot = b''
+        self.cells_lock = threading.Lock()
+        self.command_queue = queue.Queue()
+        self.reader = None
+        self.out_buffer = bytearray()
+        self.telemetry = None
+        self.map = None
+        self.robot_pos = None
+        self.resync = False
+        self.last_push = 0
+        self.thread = None
+        self.running = False
         self.active = False
+        self.dropped = 0
         self.start_mapping = False
         self.pause_mapping = False
         self.stop_mapping = False
         self.unpause_mapping = False
 
+    # Send whole map to external computer as one snapshot frame, replaces
+    # all cell updates not sent yet
     def init_map(self, map, pos):
+        self.map = map
+        self.robot_pos = pos
 
-        # Send start map to external computer
-        for y, row in enumerate(map):
-            for x, block in enumerate(row):
-                if (x, y) == pos:
-                    self.put_robot(x, y)
-                elif block == Block_type.EMPTY:
-                    self.put_empty(x, y)
-                elif block == Block_type.WALL:
-                    self.put_wall(x, y)
-                # elif block == Block_type.UNKNOWN:
-                    # self.put_unknown(x,y)
+        if not self.active:
+            return
 
-    def start_server(self, map, pos):
+        # Copy the map under the lock, a cell set while copying is either in
+        # the snapshot or added to dirty_cells after it
+        with self.cells_lock:
+            self.snapshot = protocol.encode_snapshot(
+                map.width, map.height, pos, map.to_bytes())
+            self.dirty_cells = {}
 
-        # Start server
-        self.connection = socket.socket(
+    def make_socket(self):
+        connection = socket.socket(
             socket.AF_BLUETOOTH, socket.SOCK_STREAM, socket.BTPROTO_RFCOMM)
-        self.connection.bind(("B8:27:EB:4E:FF:90", 4))
+        connection.bind(("B8:27:EB:4E:FF:90", 4))
+        return connection
+
+    # Start server thread, map is sent to every client that connects
+    def start_server(self, map, pos):
+        if self.running:
+            return
+
+        self.map = map
+        self.robot_pos = pos
+
+        self.connection = self.make_socket()
         self.connection.listen(1)
+        self.connection.settimeout(ACCEPT_TIMEOUT)
 
         print("Waiting for connection...")
 
-        # Wait for connection
-        self.client, addr = self.connection.accept()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # Server thread, accept a client and serve it until the link is lost
+    def run(self):
+        while self.running:
+            if self.client is None:
+                self.accept_client()
+                continue
+
+            try:
+                self.cycle_link()
+            except OSError as e:
+                print("Bluetooth error: ", e)
+                self.drop_client()
+
+    def accept_client(self):
+        try:
+            client, addr = self.connection.accept()
+        except socket.timeout:
+            return
+        except OSError as e:
+            if self.running:
+                print("Accept error: ", e)
+            return
+
         print(f"Accepted connection from {addr}")
 
-        # Set active to true
+        client.setblocking(False)
+        self.client = client
+        self.reader = protocol.Frame_reader()
+        self.out_buffer = bytearray()
+
+        # Set active to true and send the whole map to the new client
         self.active = True
+        self.resync = True
 
-        # Init data queue
-        self.coord_data_queue = queue.Queue()
+    def drop_client(self):
+        self.active = False
 
-        self.init_map(map, pos)
+        if self.client is not None:
+            self.client.close()
+            self.client = None
+
+        # Stop if the link was lost while driving manually
+        self.command_queue.put('stop')
+
+    # Receive commands and send what is due, waits at most until next push
+    def cycle_link(self):
+        now = time.monotonic()
+
+        if not self.out_buffer and self.telemetry is not None \
+                and now - self.last_push >= STREAM_PERIOD:
+            self.last_push = now
+            self.out_buffer += self.format_data(self.telemetry)
+
+        # Frames waiting for a slow link or no telemetry yet, wait for the
+        # link or a command instead of polling
+        if self.out_buffer or self.telemetry is None:
+            timeout = STREAM_PERIOD
+        else:
+            timeout = max(0, self.last_push + STREAM_PERIOD - now)
+
+        readable, writable, _ = select.select(
+            [self.client], [self.client] if self.out_buffer else [], [], timeout)
+
+        if readable:
+            data_in = self.client.recv(protocol.RECV_SIZE)
+            if not data_in:
+                raise ConnectionError("Connection closed")
+
+            for frame_type, payload in self.reader.feed(data_in):
+                if frame_type != protocol.COMMAND:
+                    continue
+
+                # Unknown command, count it like a corrupt frame and keep the link
+                try:
+                    message_in = protocol.decode_command(payload)
+                except ValueError:
+                    self.reader.errors += 1
+                    continue
+
+                # Polling clients ask for data, push it now
+                if message_in == "send data":
+                    self.last_push = 0
+                else:
+                    self.command_queue.put(message_in)
+
+        if writable:
+            sent = self.client.send(self.out_buffer)
+            del self.out_buffer[:sent]
+
+    # Snapshot if the map was reset, frames with all changed cells and a
+    # telemetry frame, telemetry last marks the end of the response
+    def format_data(self, data):
+        if self.resync:
+            self.resync = False
+            self.init_map(self.map, self.robot_pos)
 
-    # Format sdata
+        with self.cells_lock:
+            message_out, self.snapshot = self.snapshot, b''
+            dirty_cells, self.dirty_cells = self.dirty_cells, {}
 
-    def format_data(self, data):
-        return "auto_drive: " + str(data[0]) + " ir_front: " + str(data[1]) + " ir_left " \
-            + str(data[2]) + " ir_right: " + str(data[3]) + " odometer: " + str(data[4]) \
-            + " gyro: " + str(data[5]) + " is_mapping: " + \
-            str(data[6]) + " is_paused: " + str(data[7])
+        cells = [(cell_type, x, y) for (x, y), cell_type in dirty_cells.items()]
 
+        for i in range(0, len(cells), MAX_CELLS_PER_FRAME):
+            message_out += protocol.encode_cells(cells[i:i + MAX_CELLS_PER_FRAME])
+
+        return message_out + protocol.encode_telemetry(data)
+
+    # Called from control loop, never blocks on the link
     def cycle_server(self, data_out):
-        # Get data from external
-        data_in = self.client.recv(1024)
-        print(data_in)
-
-        print(data_in.decode('utf-8'))
-
-        # Check if data in
-        if data_in:
-
-            print(" in if")
-
-            message_in = data_in.decode('utf-8')
-
-            if message_in == "send data":
-                message_out = self.format_data(data_out)
-
-                # Check if something in data queue
-                if not self.coord_data_queue.empty():
-                    while not self.coord_data_queue.empty():
-                        message_out = message_out + " " + self.coord_data_queue.get()
-
-                 # Send data out
-                self.client.send(message_out.encode('utf-8'))
-
-            # If autodrive is off and message in instruction set, do instruction
-            auto_drive = data_out[0]
-            if auto_drive == 0 and message_in in instr_set:
-                print(f"Received: {message_in}")
-                self.motor.set_movement(message_in, 1)
-
-            # If autodrive is on and message is 'start mapping', then start mapping
-            elif auto_drive == 1:
-                if message_in == 'start mapping':
-                    message_out = ""
-                    self.client.send(message_out.encode('utf-8'))
-                    self.start_mapping = True
-                elif message_in == 'pause mapping':
-                    message_out = ""
-                    self.client.send(message_out.encode('utf-8'))
-                    self.pause_mapping = True
-                elif message_in == 'stop mapping':
-                    message_out = ""
-                    self.client.send(message_out.encode('utf-8'))
-                    self.stop_mapping = True
-                elif message_in == "unpause mapping":
-                    message_out = ""
-                    self.client.send(message_out.encode('utf-8'))
-                    self.unpause_mapping = True
+        self.telemetry = data_out
+
+        # Handle commands received by the server thread
+        while not self.command_queue.empty():
+            self.handle_command(self.command_queue.get(), data_out)
+
+    def handle_command(self, message_in, data_out):
+        # If autodrive is off and message in instruction set, do instruction
+        auto_drive = data_out[0]
+        if auto_drive == 0 and message_in in instr_set:
+            print(f"Received: {message_in}")
+            self.motor.set_movement(message_in, 1)
+
+        # If autodrive is on and message is 'start mapping', then start mapping
+        elif auto_drive == 1:
+            if message_in == 'start mapping':
+                self.start_mapping = True
+            elif message_in == 'pause mapping':
+                self.pause_mapping = True
+            elif message_in == 'stop mapping':
+                self.stop_mapping = True
+            elif message_in == "unpause mapping":
+                self.unpause_mapping = True
 
     def mapping_started(self):
         return self.start_mapping
@@ -151,69 +263,53 @@ class Server:
     def reset_mapping_unpaused(self):
         self.unpause_mapping = False
 
+    # Stop server thread and close all connections
     def close_server(self):
+        self.running = False
 
-        print("Disconnected")
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
 
-        self.client.close()
+        self.drop_client()
         self.connection.close()
-        self.active = False
 
-    def put_wall(self, x, y=-1):
+        print("Disconnected")
 
-        if not self.active:
-            return
+    # Mark a cell as changed for the external computer, updates of the same
+    # cell before it is sent replace each other
+    def put_cell(self, cell_type, x, y=-1):
 
         if y == -1:
             x, y = x[0], x[1]
 
-        message = "w " + str(x) + " " + str(y) + " "
-
-        self.coord_data_queue.put(message)
-
-    def put_robot(self, x, y=-1):
+        # Robot position is kept for the map sent to new clients
+        if cell_type == protocol.ROBOT:
+            self.robot_pos = (x, y)
 
         if not self.active:
             return
 
-        if y == -1:
-            x, y = x[0], x[1]
-
-        message = "r " + str(x) + " " + str(y) + " "
+        with self.cells_lock:
+            # Link too slow, send the whole map again when it catches up
+            if len(self.dirty_cells) >= MAX_DIRTY_CELLS and (x, y) not in self.dirty_cells:
+                self.dropped += 1
+                self.resync = True
+                return
 
-        self.coord_data_queue.put(message)
+            self.dirty_cells[(x, y)] = cell_type
 
-    def put_empty(self, x, y=-1):
-
-        if not self.active:
-            return
-
-        if y == -1:
-            x, y = x[0], x[1]
+    def put_wall(self, x, y=-1):
+        self.put_cell(protocol.WALL, x, y)
 
-        message = "e " + str(x) + " " + str(y) + " "
+    def put_robot(self, x, y=-1):
+        self.put_cell(protocol.ROBOT, x, y)
 
-        self.coord_data_queue.put(message)
+    def put_empty(self, x, y=-1):
+        self.put_cell(protocol.EMPTY, x, y)
 
     def put_unknown(self, x, y=-1):
-
-        if not self.active:
-            return
-
-        if y == -1:
-            x, y = x[0], x[1]
-
-        message = "u " + str(x) + " " + str(y) + " "
-
-        self.coord_data_queue.put(message)
+        self.put_cell(protocol.UNKNOWN, x, y)
 
     def put_path(self, x, y=-1):
-        if not self.active:
-            return
-
-        if y == -1:
-            x, y = x[0], x[1]
-
-        message = "p " + str(x) + " " + str(y) + " "
-
-        self.coord_data_queue.put(message)
+        self.put_cell(protocol.PATH, x, y)
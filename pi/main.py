@@ -1,34 +1,160 @@
 '''
  main.py
- 
+
  Created: 2023-10-31 09:51:57
  Author : G07
 '''
 
-import smbus
 import time
-import sensormodul
+import ir_conversion
+import sampler
+import scheduler
 import styrmodul
 import kommunikationsmodul
 import auto
 
 USING_BLUETOOTH = False
+# JSON file of recorded (raw, distance) IR pairs, see ir_conversion.py
+IR_CALIBRATION_FILE = None
+
+# Task periods in seconds
+SENSE_PERIOD = 0.01
+COMMS_PERIOD = 0.02
+PLAN_PERIOD = 0.01
+STATS_PERIOD = 10.0
+
+
+# Sensing, communication and autopilot, run as scheduled tasks
+class Control_loop:
+    def __init__(self, sensor, motor, server, autopilot):
+        self.sensor = sensor
+        self.motor = motor
+        self.server = server
+        self.autopilot = autopilot
+        self.scheduler = scheduler.Scheduler()
+        self.data = None
+        self.old_start_drive = None
+        self.start_flag_manual = False
+        self.verbose = True
+
+        self.scheduler.add_task("sense", self.sense, SENSE_PERIOD)
+        if USING_BLUETOOTH:
+            self.scheduler.add_task("comms", self.communicate, COMMS_PERIOD)
+        self.scheduler.add_task("plan", self.plan, PLAN_PERIOD)
+        self.scheduler.add_task("stats", self.log_stats, STATS_PERIOD)
+
+    def log(self, msg):
+        if self.verbose:
+            print("Main:")
+            print(msg)
+            print("\n")
+
+    def run(self):
+        self.scheduler.run()
+
+    def stop(self):
+        self.scheduler.stop()
+
+    # Latest sensor sample, does not wait for a new one
+    def sense(self):
+        try:
+            self.data = list(self.sensor.current())  # Read sensors
+        except Exception as e:
+            self.log("Sensor error: " + str(e))
+            return
+
+        if not USING_BLUETOOTH:
+            # If not using bluetooth, get start drive button status
+            start_drive = self.data[6]
+
+            # If was none before just update status
+            if self.old_start_drive == None:
+                self.old_start_drive = start_drive
+
+            # If status changed and auto_drive is enabled raise start-flag
+            elif not (start_drive == self.old_start_drive):
+                self.old_start_drive = start_drive
+                if self.data[0] == 1:
+                    self.start_flag_manual = True
+
+    def communicate(self):
+        if self.data is None:
+            return
+
+        data = self.data[:6]  # Get rid of start_drive, not needed
+
+        # Add if currently mapping and if paused to data to sent to external computer
+        data.append(1 if self.autopilot.is_mapping() else 0)
+        data.append(1 if self.autopilot.is_paused() else 0)
+
+        self.server.cycle_server(data)  # Perform bluetooth cycle
+
+    def plan(self):
+        if self.data is None:
+            return
+
+        autopilot = self.autopilot
+        server = self.server
+
+        # If auto drive enabled
+        if self.data[0] == 1:
 
+            # Got pause mapping from bt
+            if server.mapping_paused() and not autopilot.is_paused():
+                autopilot.pause_mapping()
 
-def main() -> int:
+            # Got unpause mapping from bt
+            elif server.mapping_unpaused() and autopilot.is_paused():
+                autopilot.unpause_mapping()
 
-    # Init bus for I2C
-    bus1 = smbus.SMBus(1)
+            # Got stop mapping from bt
+            elif server.mapping_stopped() and autopilot.is_mapping():
+                autopilot.stop_mapping()
+
+            # Got start mapping from bt
+            elif not autopilot.is_mapping() and server.mapping_started():  # External computer sent start mapping
+                autopilot.start_mapping()
+
+            # Got stop mapping from manual button
+            elif autopilot.is_mapping() and self.start_flag_manual:
+                autopilot.stop_mapping()
+                self.start_flag_manual = False
+
+            # Got start mapping from manual button
+            elif not autopilot.is_mapping() and self.start_flag_manual:
+                autopilot.start_mapping()
+                self.start_flag_manual = False
+
+            # Else perfrom autopilot cycle if mapping and not paused
+            elif autopilot.is_mapping() and not autopilot.is_paused():
+                ir_data = self.data[1], self.data[2], self.data[3]
+                autopilot.cycle_autopilot(ir_data)
+
+    def log_stats(self):
+        self.log(self.scheduler.report())
+
+
+def main(bus1=None) -> int:
+
+    # Init bus for I2C, unless given one (e.g. simulator.Sim_bus)
+    if bus1 is None:
+        import smbus
+        bus1 = smbus.SMBus(1)
     time.sleep(1)
 
-    # Init sensors, motors, server and autopilot
-    sensor = sensormodul.Sensor(bus1)
+    # IR lookup tables, fit from calibration file if there is one
+    ir_tables = None
+    if IR_CALIBRATION_FILE is not None:
+        ir_tables = ir_conversion.make_tables(
+            ir_conversion.load_calibrations(IR_CALIBRATION_FILE))
+
+    # Init sensor sampler, motors, server and autopilot
+    sensor = sampler.Sampler(bus1, tables=ir_tables)
+    sensor.start()
     motor = styrmodul.Motor(bus1, sensor)
     server = kommunikationsmodul.Server(motor)
     autopilot = auto.Autopilot(motor, server)
-
-    old_start_drive = None
-    start_flag_manual = False
+    control_loop = Control_loop(sensor, motor, server, autopilot)
 
     # If using bluetooth start server
     if USING_BLUETOOTH:
@@ -36,103 +162,24 @@ def main() -> int:
         server.start_server(autopilot.map, autopilot.pos)
 
     # Main loop
-    while True:
-        try:
-            try:
-                data = sensor.read_sensors()  # Read sensors
-            except Exception as e:
-                print("Sensor error: ", e)
-            else:
-
-                auto_drive = data[0]  # Get auto drive status
-
-                if USING_BLUETOOTH:
-
-                    data.pop()  # Get rid of start_drive, not needed
-
-                    # Add if currently mapping to data to sent to external computer
-                    if autopilot.is_mapping():
-                        data.append(1)
-                    else:
-                        data.append(0)
-
-                    # Add if currently paused to data to sent to external computer
-                    if autopilot.is_paused():
-                        data.append(1)
-                    else:
-                        data.append(0)
-
-                    try:
-                        print("Performing bluetooth cycle...")
-                        server.cycle_server(data)  # Perform bluetooth cycle
-                        print("Bluetooth cycle done.")
-                    except Exception as e:  # Lost connection
-                        print("Bluetooth error: ", e)
-                        motor.stop()
-                        print("Restarting server...")
-                        server.close_server()  # Close and restart server
-                        server.start_server(autopilot.map, autopilot.pos)
-                else:
-                    # If not using bluetooth, get start drive button status
-                    start_drive = data[6]
-
-                    # If was none before just update status
-                    if old_start_drive == None:
-                        old_start_drive = start_drive
-
-                    # If status changed and auto_drive is enabled raise start-flag
-                    elif not (start_drive == old_start_drive):
-                        old_start_drive = start_drive
-                        if auto_drive == 1:
-                            start_flag_manual = True
-
-                # If auto drive enabled
-                if auto_drive == 1:
-
-                    # Got pause mapping from bt
-                    if server.mapping_paused() and not autopilot.is_paused():
-                        autopilot.pause_mapping()
-
-                    # Got unpause mapping from bt
-                    elif server.mapping_unpaused() and autopilot.is_paused():
-                        autopilot.unpause_mapping()
-
-                    # Got stop mapping from bt
-                    elif server.mapping_stopped() and autopilot.is_mapping():
-                        autopilot.stop_mapping()
-
-                    # Got start mapping from bt
-                    elif not autopilot.is_mapping() and server.mapping_started():  # External computer sent start mapping
-                        autopilot.start_mapping()
-
-                    # Got stop mapping from manual button
-                    elif autopilot.is_mapping() and start_flag_manual:
-                        autopilot.stop_mapping()
-                        start_flag_manual = False
-
-                    # Got start mapping from manual button
-                    elif not autopilot.is_mapping() and start_flag_manual:
-                        autopilot.start_mapping()
-                        start_flag_manual = False
-
-                    # Else perfrom autopilot cycle if mapping and not paused
-                    elif autopilot.is_mapping() and not autopilot.is_paused():
-                        print("Performing autopilot cycle...")
-                        ir_data = data[1], data[2], data[3]
-                        autopilot.cycle_autopilot(ir_data)
-                        print("Autopilot cycle done.")
-
-        # Stop program with Ctrl + C
-        except KeyboardInterrupt:
-            motor.stop()
-            print("Keyboard interrupt: ", e)
-            break
-
-        # Other exceptions
-        except Exception as e:
-            motor.stop()
-            print("Exception: ", e)
-            raise TypeError("Error")
+    try:
+        control_loop.run()
+
+    # Stop program with Ctrl + C
+    except KeyboardInterrupt as e:
+        motor.stop()
+        sensor.stop()
+        print("Keyboard interrupt: ", e)
+
+    # Other exceptions
+    except Exception as e:
+        motor.stop()
+        sensor.stop()
+        print("Exception: ", e)
+        raise TypeError("Error")
+
+    finally:
+        print(control_loop.scheduler.report())
 
     return 0
 
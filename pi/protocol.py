@@ -0,0 +1,265 @@
+'''
+ protocol.py
+
+ Binary framing for the Bluetooth link between kommunikationsmodul.Server
+ and the ground station (extern/mainWindow.py).
+
+ Every frame is a header followed by length bytes of payload:
+   magic 'KR', version, frame type, payload length (little endian uint16)
+'''
+
+import re
+import struct
+
+MAGIC = b'KR'
+VERSION = 1
+HEADER = struct.Struct('<2sBBH')
+MAX_PAYLOAD = 0xFFFF
+RECV_SIZE = 4096
+
+# Frame types
+TELEMETRY = 1
+CELLS = 2
+COMMAND = 3
+SNAPSHOT = 4
+
+# Telemetry: flags, ir_front, ir_left, ir_right (half floats, cm),
+# odometer, gyro
+TELEMETRY_DATA = struct.Struct('<BeeeHB')
+FLAG_AUTO_DRIVE = 0x01
+FLAG_MAPPING = 0x02
+FLAG_PAUSED = 0x04
+
+# Cell types, same letters as the old text protocol
+WALL = 0
+EMPTY = 1
+ROBOT = 2
+UNKNOWN = 3
+PATH = 4
+CELL_LETTERS = ['w', 'e', 'r', 'u', 'p']
+
+# Cell updates: type and position relative to the previous cell in the
+# frame (first cell relative to (0, 0)). Cells too far from the previous
+# one have ABSOLUTE set in the type byte and a full position instead.
+CELL_DELTA = struct.Struct('<Bbb')
+CELL_ABSOLUTE = struct.Struct('<Bhh')
+ABSOLUTE = 0x80
+
+# Snapshot of the whole map: width, height, robot x, robot y, encoding and
+# the grid.Grid codes of all squares, either as (code, count) runs or
+# packed four squares per byte, whichever is smaller
+SNAPSHOT_HEADER = struct.Struct('<HHhhB')
+RUN_LENGTH = 0
+PACKED = 1
+MAX_RUN = 255
+RUN_PATTERN = re.compile(rb'(.)\1*', re.DOTALL)
+
+# Commands, sent as the index in this list
+COMMANDS = ['fwd', 'back', 'left', 'right', 'fwd_right', 'fwd_left', 'stop',
+            'send data', 'start mapping', 'pause mapping', 'stop mapping',
+            'unpause mapping']
+
+
+def encode_frame(frame_type, payload):
+    if len(payload) > MAX_PAYLOAD:
+        raise ValueError("Payload too long: " + str(len(payload)))
+
+    return HEADER.pack(MAGIC, VERSION, frame_type, len(payload)) + payload
+
+
+# Reassembles frames from a byte stream. Data can be fed in chunks of any
+# size, frames split over several chunks are returned once complete
+class Frame_reader:
+    def __init__(self):
+        self.buffer = bytearray()
+        self.errors = 0
+
+    # Add received data, list of (frame type, payload) completed by it
+    def feed(self, data):
+        self.buffer += data
+        buffer = self.buffer
+        frames = []
+        offset = 0
+
+        while len(buffer) - offset >= HEADER.size:
+            magic, version, frame_type, length = HEADER.unpack_from(buffer, offset)
+
+            # Not a frame start, skip to next magic
+            if magic != MAGIC or version != VERSION:
+                self.errors += 1
+                offset = buffer.find(MAGIC, offset + 1)
+                if offset == -1:
+                    offset = len(buffer) - (len(MAGIC) - 1)
+                continue
+
+            end = offset + HEADER.size + length
+            if end > len(buffer):
+                break
+
+            frames.append((frame_type, bytes(buffer[offset + HEADER.size:end])))
+            offset = end
+
+        del buffer[:offset]
+        return frames
+
+    # Number of bytes of an incomplete frame
+    def pending(self):
+        return len(self.buffer)
+
+
+# Decode data holding only complete frames, list of (frame type, payload)
+def decode_frames(data):
+    reader = Frame_reader()
+    frames = reader.feed(data)
+
+    if reader.errors or reader.pending():
+        raise ValueError("Not a sequence of complete frames")
+
+    return frames
+
+
+# Sensor data list from main.py: auto_drive, ir_front, ir_left, ir_right,
+# odometer, gyro, is_mapping, is_paused
+def encode_telemetry(data):
+    flags = 0
+    if data[0]:
+        flags |= FLAG_AUTO_DRIVE
+    if data[6]:
+        flags |= FLAG_MAPPING
+    if data[7]:
+        flags |= FLAG_PAUSED
+
+    return encode_frame(TELEMETRY, TELEMETRY_DATA.pack(
+        flags, data[1], data[2], data[3], data[4], data[5]))
+
+
+# Inverse of encode_telemetry, same list layout
+def decode_telemetry(payload):
+    flags, ir_front, ir_left, ir_right, odometer, gyro = TELEMETRY_DATA.unpack(payload)
+
+    return [int(bool(flags & FLAG_AUTO_DRIVE)), ir_front, ir_left, ir_right,
+            odometer, gyro, int(bool(flags & FLAG_MAPPING)), int(bool(flags & FLAG_PAUSED))]
+
+
+# Frame of cell updates from a list of (cell type, x, y)
+def encode_cells(cells):
+    payload = bytearray()
+    last_x, last_y = 0, 0
+
+    for cell_type, x, y in cells:
+        dx, dy = x - last_x, y - last_y
+        if -128 <= dx <= 127 and -128 <= dy <= 127:
+            payload += CELL_DELTA.pack(cell_type, dx, dy)
+        else:
+            payload += CELL_ABSOLUTE.pack(cell_type | ABSOLUTE, x, y)
+        last_x, last_y = x, y
+
+    return encode_frame(CELLS, bytes(payload))
+
+
+# Inverse of encode_cells, list of (cell type, x, y)
+def decode_cells(payload):
+    cells = []
+    x, y = 0, 0
+    offset = 0
+
+    while offset < len(payload):
+        if payload[offset] & ABSOLUTE:
+            cell_type, x, y = CELL_ABSOLUTE.unpack_from(payload, offset)
+            cell_type &= ~ABSOLUTE
+            offset += CELL_ABSOLUTE.size
+        else:
+            cell_type, dx, dy = CELL_DELTA.unpack_from(payload, offset)
+            x, y = x + dx, y + dy
+            offset += CELL_DELTA.size
+        cells.append((cell_type, x, y))
+
+    return cells
+
+
+# Runs of equal codes as (code, count) byte pairs
+def encode_runs(cells):
+    runs = bytearray()
+
+    for match in RUN_PATTERN.finditer(cells):
+        code = match.group(1)[0]
+        count = match.end() - match.start()
+        while count > 0:
+            runs += bytes((code, min(count, MAX_RUN)))
+            count -= MAX_RUN
+
+    return runs
+
+
+def decode_runs(runs):
+    return b''.join(bytes([runs[i]]) * runs[i + 1] for i in range(0, len(runs), 2))
+
+
+# Codes 0 to 3 packed two bits each, first square in the lowest bits. The
+# four squares of every byte are combined with one big integer per position
+def encode_packed(cells):
+    size = (len(cells) + 3) // 4
+    cells = bytes(cells) + bytes(size * 4 - len(cells))
+
+    packed = 0
+    for i in range(4):
+        packed |= int.from_bytes(cells[i::4], 'little') << (2 * i)
+
+    return packed.to_bytes(size, 'little')
+
+
+def decode_packed(packed, count):
+    mask = int.from_bytes(b'\x03' * len(packed), 'little')
+    value = int.from_bytes(packed, 'little')
+
+    cells = bytearray(len(packed) * 4)
+    for i in range(4):
+        cells[i::4] = ((value >> (2 * i)) & mask).to_bytes(len(packed), 'little')
+
+    return bytes(cells[:count])
+
+
+# Frame with every square of a map, cells is one code per square in
+# grid.Grid order
+def encode_snapshot(width, height, robot_pos, cells):
+    data = encode_runs(cells)
+    encoding = RUN_LENGTH
+
+    if max(cells, default=0) < 4:
+        packed = encode_packed(cells)
+        if len(packed) < len(data):
+            data = packed
+            encoding = PACKED
+
+    return encode_frame(SNAPSHOT, SNAPSHOT_HEADER.pack(
+        width, height, robot_pos[0], robot_pos[1], encoding) + data)
+
+
+# Inverse of encode_snapshot, width, height, robot_pos and cells
+def decode_snapshot(payload):
+    width, height, robot_x, robot_y, encoding = SNAPSHOT_HEADER.unpack_from(payload)
+    data = payload[SNAPSHOT_HEADER.size:]
+
+    if encoding == RUN_LENGTH:
+        cells = decode_runs(data)
+    elif encoding == PACKED:
+        cells = decode_packed(data, width * height)
+    else:
+        raise ValueError("Unknown snapshot encoding: " + str(encoding))
+
+    if len(cells) != width * height:
+        raise ValueError("Snapshot has " + str(len(cells)) + " squares, expected "
+                         + str(width * height))
+
+    return width, height, (robot_x, robot_y), cells
+
+
+def encode_command(command):
+    return encode_frame(COMMAND, bytes([COMMANDS.index(command)]))
+
+
+def decode_command(payload):
+    if len(payload) != 1 or payload[0] >= len(COMMANDS):
+        raise ValueError("Unknown command: " + payload.hex())
+
+    return COMMANDS[payload[0]]
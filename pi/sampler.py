@@ -0,0 +1,151 @@
+import threading
+import time
+from collections import deque
+from typing import NamedTuple
+import sensormodul
+
+SAMPLE_RATE = 100  # Hz
+BUFFER_SIZE = 256  # Samples kept in ring buffer
+SAMPLE_TIMEOUT = 0.5  # Seconds to wait for a new sample before giving up
+
+
+# Sensor snapshot and the time it was read
+class Sample(NamedTuple):
+    timestamp: float
+    data: sensormodul.Sensor_data
+
+
+# Polls all sensors at a fixed rate in a background thread. Consumers read
+# the latest sample or a window of samples without touching the I2C bus.
+# Has the same getters as sensormodul.Sensor so it can be used in its place.
+class Sampler:
+    def __init__(self, bus, rate=SAMPLE_RATE, size=BUFFER_SIZE, tables=None):
+        self.sensor = sensormodul.Sensor(bus, tables)
+        self.period = 1 / rate
+        self.samples = deque(maxlen=size)
+        self.latest_sample = None
+        self.new_sample = threading.Condition()
+        self.thread = None
+        self.running = False
+        self.errors = 0
+        self.overruns = 0
+        self.verbose = True
+
+    def log(self, msg):
+        if self.verbose:
+            print("Sampler:")
+            print(msg)
+            print("\n")
+
+    # Start polling in background thread
+    def start(self):
+        if self.running:
+            return
+
+        self.running = True
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    # Stop polling and wait for thread to finish
+    def stop(self):
+        self.running = False
+
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+    # Sampling loop, one burst read every period
+    def run(self):
+        next_time = time.monotonic()
+
+        while self.running:
+            try:
+                data = self.sensor.read_snapshot()
+            except OSError as e:
+                self.errors += 1
+                self.log("Sensor error: " + str(e))
+            else:
+                sample = Sample(time.monotonic(), data)
+
+                # Append and reference assignment are atomic, readers need no lock
+                self.samples.append(sample)
+                self.latest_sample = sample
+
+                with self.new_sample:
+                    self.new_sample.notify_all()
+
+            # Sleep until next period. If behind, skip missed periods
+            next_time += self.period
+            delay = next_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            else:
+                self.overruns += 1
+                next_time = time.monotonic()
+
+    # Get latest sample without waiting
+    def latest(self):
+        return self.latest_sample
+
+    # Get all samples not older than duration seconds, oldest first
+    def window(self, duration):
+        # list() copies the deque in one step while holding the GIL
+        samples = list(self.samples)
+        start_time = time.monotonic() - duration
+
+        return [sample for sample in samples if sample.timestamp >= start_time]
+
+    # Wait for a sample newer than timestamp (or newer than latest if None)
+    def wait_for_sample(self, timestamp=None, timeout=SAMPLE_TIMEOUT):
+        if timestamp is None and self.latest_sample is not None:
+            timestamp = self.latest_sample.timestamp
+
+        with self.new_sample:
+            self.new_sample.wait_for(
+                lambda: self.latest_sample is not None
+                and (timestamp is None or self.latest_sample.timestamp > timestamp),
+                timeout)
+
+        sample = self.latest_sample
+        if sample is None or (timestamp is not None and sample.timestamp <= timestamp):
+            raise OSError("No new sensor sample")
+
+        return sample
+
+    # Get the next sample, paces control loops at the sample rate
+    def read_snapshot(self):
+        return self.wait_for_sample().data
+
+    # Read all sensors
+    def read_sensors(self):
+        return list(self.read_snapshot())
+
+    # Get current snapshot, waits only if nothing has been sampled yet
+    def current(self):
+        sample = self.latest_sample
+
+        if sample is None:
+            sample = self.wait_for_sample()
+
+        return sample.data
+
+    def get_automatic_drive(self):
+        return self.current().automatic_drive
+
+    def get_ir_front(self):
+        return self.current().ir_front
+
+    def get_ir_left(self):
+        return self.current().ir_left
+
+    def get_ir_right(self):
+        return self.current().ir_right
+
+    def get_odometer(self):
+        return self.current().odometer
+
+    def get_gyro(self):
+        return self.current().gyro
+
+    def get_start_drive(self):
+        return self.current().start_drive
@@ -0,0 +1,127 @@
+import time
+
+STATS_DECIMALS = 6
+
+
+# Timing statistics of one task, times in seconds
+class Task_stats:
+    def __init__(self):
+        self.runs = 0
+        self.overruns = 0
+        self.missed = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+        self.total_jitter = 0.0
+        self.max_jitter = 0.0
+
+    def get_mean_time(self):
+        return self.total_time / self.runs if self.runs else 0.0
+
+    def get_mean_jitter(self):
+        return self.total_jitter / self.runs if self.runs else 0.0
+
+    def to_dict(self):
+        return {
+            "runs": self.runs,
+            "overruns": self.overruns,
+            "missed": self.missed,
+            "mean_time": round(self.get_mean_time(), STATS_DECIMALS),
+            "max_time": round(self.max_time, STATS_DECIMALS),
+            "mean_jitter": round(self.get_mean_jitter(), STATS_DECIMALS),
+            "max_jitter": round(self.max_jitter, STATS_DECIMALS),
+        }
+
+
+# Function called every period seconds
+class Task:
+    def __init__(self, name, function, period):
+        self.name = name
+        self.function = function
+        self.period = period
+        self.next_time = None
+        self.stats = Task_stats()
+
+    # Call function and record how late it started and how long it took
+    def run(self, now):
+        jitter = now - self.next_time
+        self.function()
+        run_time = time.monotonic() - now
+
+        stats = self.stats
+        stats.runs += 1
+        stats.total_time += run_time
+        stats.max_time = max(stats.max_time, run_time)
+        stats.total_jitter += jitter
+        stats.max_jitter = max(stats.max_jitter, jitter)
+        if run_time > self.period:
+            stats.overruns += 1
+
+        # Next deadline on the fixed grid. If behind, skip missed periods
+        self.next_time += self.period
+        end = now + run_time
+        if self.next_time <= end:
+            missed = int((end - self.next_time) // self.period) + 1
+            stats.missed += missed
+            self.next_time += missed * self.period
+
+
+# Runs tasks at fixed rates in one thread. Tasks are run in the order they
+# were added when several are due, and the scheduler sleeps until the next
+# deadline. Tasks must not block for long, a slow task delays the others
+# and shows up as their jitter.
+class Scheduler:
+    def __init__(self):
+        self.tasks = []
+        self.running = False
+        self.start_time = None
+
+    def add_task(self, name, function, period):
+        task = Task(name, function, period)
+        self.tasks.append(task)
+        return task
+
+    # Run all tasks that are due, return time until the next deadline
+    def run_once(self):
+        now = time.monotonic()
+        if self.start_time is None:
+            self.start_time = now
+
+        for task in self.tasks:
+            if task.next_time is None:
+                task.next_time = now
+            if task.next_time <= now:
+                task.run(now)
+                now = time.monotonic()
+
+        return min(task.next_time for task in self.tasks) - now
+
+    # Run tasks until stop is called
+    def run(self):
+        self.running = True
+
+        while self.running:
+            delay = self.run_once()
+            if delay > 0:
+                time.sleep(delay)
+
+    def stop(self):
+        self.running = False
+
+    # Statistics of all tasks by name
+    def get_stats(self):
+        return {task.name: task.stats.to_dict() for task in self.tasks}
+
+    # One line per task, for logging
+    def report(self):
+        lines = []
+        for task in self.tasks:
+            stats = task.stats
+            lines.append(
+                "{}: period {:.1f} ms, runs {}, mean {:.2f} ms, max {:.2f} ms, "
+                "jitter mean {:.2f} ms max {:.2f} ms, overruns {}, missed {}".format(
+                    task.name, task.period * 1000, stats.runs,
+                    stats.get_mean_time() * 1000, stats.max_time * 1000,
+                    stats.get_mean_jitter() * 1000, stats.max_jitter * 1000,
+                    stats.overruns, stats.missed))
+
+        return "\n".join(lines)
@@ -0,0 +1,198 @@
+import heapq
+
+# Steps (d pos[0], d pos[1]) in the same order as auto.Compass:
+# NORTH, SOUTH, WEST, EAST
+DIRECTIONS = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+
+
+# Path searches on a flat grid. All per-search arrays are allocated once
+# and reused, a generation stamp tells which entries belong to the current
+# search so nothing has to be cleared between searches. Squares are
+# (x, y) tuples, same as grid.Grid.
+class Search_workspace:
+    def __init__(self, width, height, drive_cost, turn_cost):
+        self.drive_cost = drive_cost
+        self.turn_cost = turn_cost
+        self.generation = 0
+        self.heap = []
+        self.open = bytearray()
+        self.open_value = 1
+        self.resize(width, height)
+
+    # Allocate arrays for a grid of new size
+    def resize(self, width, height):
+        self.width = width
+        self.height = height
+        size = width * height
+
+        # Per square, used by bfs
+        self.seen = [0] * size
+        self.parent = [-1] * size
+        self.queue = [0] * size
+
+        # Per (square, heading) state, used by a_star
+        self.state_seen = [0] * (size * 4)
+        self.state_parent = [-1] * (size * 4)
+        self.state_cost = [0.0] * (size * 4)
+
+    # Search grid, squares with code open_value are open. The cells are
+    # used directly and not copied, resize if grid size changed
+    def load(self, grid, open_value):
+        if grid.width != self.width or grid.height != self.height:
+            self.resize(grid.width, grid.height)
+
+        self.open = grid.cells
+        self.open_value = open_value
+
+    # Start a new search, invalidates all entries of earlier searches
+    def next_generation(self):
+        self.generation += 1
+        return self.generation
+
+    def get_index(self, square):
+        return square[1] * self.width + square[0]
+
+    def get_square(self, index):
+        return index % self.width, index // self.width
+
+    # Follow parent pointers from index back to start
+    def make_path(self, parent, index, to_square):
+        path = []
+        while index != -1:
+            path.append(to_square(index))
+            index = parent[index]
+
+        path.reverse()
+        return path
+
+    # Breadth first search, path with fewest squares from start to end
+    def bfs(self, start, end):
+        generation = self.next_generation()
+        width, height = self.width, self.height
+        open_squares, open_value = self.open, self.open_value
+        seen, parent, queue = self.seen, self.parent, self.queue
+
+        start_index = self.get_index(start)
+        end_index = self.get_index(end)
+
+        seen[start_index] = generation
+        parent[start_index] = -1
+        queue[0] = start_index
+        head, tail = 0, 1
+
+        while head < tail:
+            index = queue[head]
+            head += 1
+
+            if index == end_index:
+                return self.make_path(parent, index, self.get_square)
+
+            x, y = index % width, index // width
+
+            for dx, dy in DIRECTIONS:
+                adjacent_x, adjacent_y = x + dx, y + dy
+                if not (0 <= adjacent_x < width and 0 <= adjacent_y < height):
+                    continue
+
+                adjacent = adjacent_y * width + adjacent_x
+                if open_squares[adjacent] == open_value and seen[adjacent] != generation:
+                    seen[adjacent] = generation
+                    parent[adjacent] = index
+                    queue[tail] = adjacent
+                    tail += 1
+
+        return None
+
+    # Least possible cost from square to end when facing heading
+    def heuristic(self, x, y, end_x, end_y, heading):
+        dx = end_x - x
+        dy = end_y - y
+
+        # Every heading the path must use, except the current one, needs a turn
+        turns = 0
+        if dx:
+            turns += (1 if dx > 0 else 0) != heading
+        if dy:
+            turns += (3 if dy > 0 else 2) != heading
+
+        return (abs(dx) + abs(dy)) * self.drive_cost + turns * self.turn_cost
+
+    # A* over (square, heading) states, path from start to end with least cost
+    def a_star(self, start, end, heading):
+        end_x, end_y = end
+        end_index = self.get_index(end)
+
+        return self.turn_search(
+            start, heading, lambda index: index == end_index,
+            lambda x, y, next_heading: self.heuristic(x, y, end_x, end_y, next_heading))
+
+    # Dijkstra over (square, heading) states from start, path to the cheapest
+    # square other than start for which is_target(square) is true
+    def nearest(self, start, heading, is_target):
+        start_index = self.get_index(start)
+        checked = self.seen
+
+        # Check every square once, not once per heading it is reached with
+        def is_end(index):
+            if index == start_index or checked[index] == self.generation:
+                return False
+            checked[index] = self.generation
+            return is_target(self.get_square(index))
+
+        return self.turn_search(start, heading, is_end, lambda x, y, next_heading: 0)
+
+    # Best first search over (square, heading) states, state index is square
+    # index * 4 + heading. Driving a square costs drive_cost and changing
+    # heading costs turn_cost. Stops at first state where is_end(square index)
+    # is true, estimate(x, y, heading) must not overestimate the remaining cost
+    def turn_search(self, start, heading, is_end, estimate):
+        generation = self.next_generation()
+        width, height = self.width, self.height
+        drive_cost, turn_cost = self.drive_cost, self.turn_cost
+        open_squares, open_value = self.open, self.open_value
+        seen, parent, cost = self.state_seen, self.state_parent, self.state_cost
+        heap = self.heap
+        heap.clear()
+
+        start_state = self.get_index(start) * 4 + heading
+        seen[start_state] = generation
+        parent[start_state] = -1
+        cost[start_state] = 0.0
+        heap.append((estimate(start[0], start[1], heading), 0.0, start_state))
+
+        while heap:
+            _, current_cost, state = heapq.heappop(heap)
+
+            # Skip if a cheaper way to this state has been found
+            if current_cost > cost[state]:
+                continue
+
+            index, current_heading = state >> 2, state & 3
+
+            if is_end(index):
+                return self.make_path(parent, state, lambda s: self.get_square(s >> 2))
+
+            x, y = index % width, index // width
+
+            for next_heading, (dx, dy) in enumerate(DIRECTIONS):
+                adjacent_x, adjacent_y = x + dx, y + dy
+                if not (0 <= adjacent_x < width and 0 <= adjacent_y < height):
+                    continue
+
+                adjacent = adjacent_y * width + adjacent_x
+                if open_squares[adjacent] != open_value:
+                    continue
+
+                next_cost = current_cost + drive_cost
+                if next_heading != current_heading:
+                    next_cost += turn_cost
+
+                next_state = adjacent * 4 + next_heading
+                if seen[next_state] != generation or next_cost < cost[next_state]:
+                    seen[next_state] = generation
+                    parent[next_state] = state
+                    cost[next_state] = next_cost
+                    heapq.heappush(heap, (next_cost + estimate(
+                        adjacent_x, adjacent_y, next_heading), next_cost, next_state))
+
+        return None
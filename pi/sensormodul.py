@@ -1,10 +1,13 @@
-import smbus
 import time
 from enum import Enum
-from ir_conversion import linearize_ir_data
+from typing import NamedTuple
+import ir_conversion
 
 SENSOR_ADDRESS = 0x24
-IR_LEFT_ERROR = 1.5
+REGISTER_COUNT = 8
+
+# Read the whole register file in one auto-incrementing I2C transaction
+BURST_READ = True
 
 
 class Internal_address(Enum):
@@ -18,60 +21,49 @@ class Internal_address(Enum):
     START_DRIVE = 7
 
 
+# Converted values of all sensors read at the same time
+class Sensor_data(NamedTuple):
+    automatic_drive: int
+    ir_front: float
+    ir_left: float
+    ir_right: float
+    odometer: int
+    gyro: int
+    start_drive: int
+
+
 class Sensor:
-    def __init__(self, bus):
+    # tables: IR lookup tables by sensor name, see ir_conversion.make_tables
+    def __init__(self, bus, tables=None):
         self.bus = bus
+        self.ir_tables = tables or ir_conversion.DEFAULT_TABLES
 
     def get_automatic_drive(self):
-        self.set_sensor(Internal_address.AUTOMATIC_DRIVE)
-
-        return self.read_current_sensor()
+        return self.read_snapshot().automatic_drive
 
     def get_ir_front(self):
-        self.set_sensor(Internal_address.IR_FRONT)
-
-        return linearize_ir_data(self.read_current_sensor())
+        return self.read_snapshot().ir_front
 
     def get_ir_left(self):
-        self.set_sensor(Internal_address.IR_LEFT)
-
-        data = linearize_ir_data(self.read_current_sensor())
-        
-        if 0 < data < 255:
-            return data + IR_LEFT_ERROR
-        else:
-            return data
-        
-    def get_ir_right(self):
-        self.set_sensor(Internal_address.IR_RIGHT)
+        return self.read_snapshot().ir_left
 
-        return linearize_ir_data(self.read_current_sensor())
+    def get_ir_right(self):
+        return self.read_snapshot().ir_right
 
     def get_odometer_h(self):
-        self.set_sensor(Internal_address.ODOMETER_H)
-
-        return self.read_current_sensor()
+        return self.read_registers()[Internal_address.ODOMETER_H.value]
 
     def get_odometer_l(self):
-        self.set_sensor(Internal_address.ODOMETER_L)
-
-        return self.read_current_sensor()
+        return self.read_registers()[Internal_address.ODOMETER_L.value]
 
     def get_odometer(self):
-        odometer_h = self.get_odometer_h()
-        odometer_l = self.get_odometer_l()
-
-        return (odometer_h << 8) | odometer_l
+        return self.read_snapshot().odometer
 
     def get_gyro(self):
-        self.set_sensor(Internal_address.GYRO)
-
-        return self.read_current_sensor()
+        return self.read_snapshot().gyro
 
     def get_start_drive(self):
-        self.set_sensor(Internal_address.START_DRIVE)
-
-        return self.read_current_sensor()
+        return self.read_snapshot().start_drive
 
     def set_sensor(self, sensor):
         self.bus.write_byte(SENSOR_ADDRESS, sensor.value)
@@ -82,15 +74,36 @@ class Sensor:
 
         return result
 
+    # Read raw register file, AUTOMATIC_DRIVE through START_DRIVE
+    def read_registers(self):
+        if BURST_READ:
+            # Sensor module auto-increments the register for every byte read
+            return self.bus.read_i2c_block_data(
+                SENSOR_ADDRESS, Internal_address.AUTOMATIC_DRIVE.value, REGISTER_COUNT)
+
+        registers = []
+        for address in Internal_address:
+            self.set_sensor(address)
+            registers.append(self.read_current_sensor())
+
+        return registers
+
+    # Read all sensors and convert to a snapshot
+    def read_snapshot(self):
+        registers = self.read_registers()
+        tables = self.ir_tables
+
+        return Sensor_data(
+            automatic_drive=registers[Internal_address.AUTOMATIC_DRIVE.value],
+            ir_front=tables["ir_front"][registers[Internal_address.IR_FRONT.value]],
+            ir_left=tables["ir_left"][registers[Internal_address.IR_LEFT.value]],
+            ir_right=tables["ir_right"][registers[Internal_address.IR_RIGHT.value]],
+            odometer=(registers[Internal_address.ODOMETER_H.value] << 8)
+            | registers[Internal_address.ODOMETER_L.value],
+            gyro=registers[Internal_address.GYRO.value],
+            start_drive=registers[Internal_address.START_DRIVE.value])
+
     # Read all sensors
     def read_sensors(self):
 
-        automatic_drive = self.get_automatic_drive()
-        ir_front = self.get_ir_front()
-        ir_left = self.get_ir_left()
-        ir_right = self.get_ir_right()
-        odometer = self.get_odometer()
-        gyro = self.get_gyro()
-        start_drive = self.get_start_drive()
-
-        return [automatic_drive, ir_front, ir_left, ir_right, odometer, gyro, start_drive]
+        return list(self.read_snapshot())
@@ -0,0 +1,485 @@
+'''
+ simulator.py
+
+ Simulated I2C bus and maze world for running the Pi code without the
+ robot. Sim_bus is a drop-in replacement for smbus.SMBus that answers as
+ the sensor module (0x24) and the motor module (0x7F). Time is virtual and
+ only advances on bus transactions and sleeps, so runs are much faster than
+ real time.
+
+ Usage: python simulator.py [maze file] [--noise cm] [--gyro-offset value]
+   --gyro-offset: gyro value when still, the autopilot estimates the bias
+'''
+
+import argparse
+import math
+import random
+import heading
+import sensormodul
+import styrmodul
+import auto
+
+SENSOR_ADDRESS = sensormodul.SENSOR_ADDRESS
+MOTOR_ADDRESS = styrmodul.MOTOR_ADDRESS
+
+CELL_SIZE = 40  # cm
+MAX_WHEEL_SPEED = 50  # cm/s at speed 63
+TRACK_WIDTH = 16  # cm between wheels
+TICK_LENGTH = styrmodul.CELL_LENGTH / styrmodul.DRIVE_COEFF  # cm per odometer tick
+# Forward speed lag after a new command. Coasting to a stop from
+# DRIVE_SPEED is STOP_DRIVE_COEFF ticks, which drive_forward expects
+DRIVE_TIME_CONSTANT = (styrmodul.STOP_DRIVE_COEFF * TICK_LENGTH /
+                       (styrmodul.DRIVE_SPEED * MAX_WHEEL_SPEED))
+# Rotation lag, turning in place scrubs the wheels and stops much faster
+TURN_TIME_CONSTANT = 0.05
+GYRO_SCALE = 3  # deg/s per gyro unit
+GYRO_OFFSET = 127  # Gyro value when still
+ROBOT_RADIUS = 10  # cm
+FRONT_SENSOR_OFFSET = 8  # cm from robot centre
+SIDE_SENSOR_OFFSET = 9  # cm from robot centre
+IR_LEFT_BIAS = 1.5  # cm, left IR reads short (see ir_conversion.IR_LEFT_ERROR)
+IR_MAX_RANGE = 150  # cm
+BYTE_TIME = 0.0001  # s per byte on the bus (100 kHz)
+PHYSICS_STEP = 0.001  # s
+DEFAULT_TIME_LIMIT = 3600  # Simulated seconds
+COAST_TIME = 0.5  # s, time for the robot to stop after the motors are stopped
+
+DEFAULT_MAZE = [
+    "#################",
+    "#################",
+    "#################",
+    "#################",
+    "####.......######",
+    "####.#####.######",
+    "####.#...#.######",
+    "####.#.#.#.######",
+    "####...#...######",
+    "#######.#########",
+    "#################",
+    "#################",
+    "#################",
+    "#################",
+    "#################",
+    "#################",
+    "#################",
+]
+
+
+# Virtual clock, replaces the time module in simulated modules
+class Sim_clock:
+    def __init__(self, world):
+        self.world = world
+        self.now = 0.0
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+    def perf_counter(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.advance(seconds)
+
+    # Advance time and step the world
+    def advance(self, seconds):
+        while seconds > 0:
+            dt = min(seconds, PHYSICS_STEP)
+            self.world.step(dt)
+            self.now += dt
+            seconds -= dt
+
+
+# Grid maze with a differential drive robot. Maze rows are indexed by
+# pos[0] and columns by pos[1], same as Autopilot.pos. '#' is a wall.
+class Maze_world:
+    def __init__(self, maze, start=auto.START_POS, noise=0.0, seed=0,
+                 gyro_offset=GYRO_OFFSET):
+        self.maze = [row for row in maze]
+        self.height = len(maze)
+        self.width = len(maze[0])
+
+        # Robot centre in cm, heading in radians. 0 is north, positive is left
+        self.y = start[0] * CELL_SIZE + CELL_SIZE / 2
+        self.x = start[1] * CELL_SIZE + CELL_SIZE / 2
+        self.angle = 0.0
+
+        # Commanded and actual wheel speeds in cm/s, positive forward
+        self.target_left = 0.0
+        self.target_right = 0.0
+        self.speed_left = 0.0
+        self.speed_right = 0.0
+
+        # Actual forward speed in cm/s and rotation in rad/s, positive left
+        self.speed = 0.0
+        self.rotation = 0.0
+
+        self.odometer = 0.0
+        self.distance = 0.0
+        self.collisions = 0
+        self.automatic_drive = 1
+        self.start_drive = 1
+
+        self.noise = noise
+        self.random = random.Random(seed)
+        self.gyro_offset = gyro_offset
+
+        # Set by Sim_motor during a turn. The turn is measured when the robot
+        # next starts from standstill, after it has coasted to a stop
+        self.turning = False
+        self.turn_start = None
+        self.turn_target = 0.0
+        self.turn_errors = []  # Degrees turned too far, negative too short
+
+    def is_wall(self, row, col):
+        if not (0 <= row < self.height and 0 <= col < self.width):
+            return True
+        return self.maze[row][col] == '#'
+
+    # Record the error of the last turn, if not recorded yet
+    def end_turn(self):
+        if self.turn_start is not None:
+            turned = math.degrees(self.angle - self.turn_start)
+            self.turn_errors.append(abs(turned) - abs(self.turn_target))
+            self.turn_start = None
+
+    # Current cell of the robot centre
+    def get_pos(self):
+        return int(self.y // CELL_SIZE), int(self.x // CELL_SIZE)
+
+    # Set wheel speed from a motor byte written by Motor.set_movement
+    def write_motor(self, byte):
+        speed = (byte & 0x3F) / 63 * MAX_WHEEL_SPEED
+
+        if not byte & 0x40:
+            speed = -speed
+
+        if speed and not self.target_left and not self.target_right and not self.turning:
+            self.end_turn()
+
+        if byte & 0x80:
+            self.target_right = speed
+        else:
+            self.target_left = speed
+
+    # Check if robot body at (y, x) overlaps a wall cell
+    def is_blocked(self, y, x):
+        row_min = int((y - ROBOT_RADIUS) // CELL_SIZE)
+        row_max = int((y + ROBOT_RADIUS) // CELL_SIZE)
+        col_min = int((x - ROBOT_RADIUS) // CELL_SIZE)
+        col_max = int((x + ROBOT_RADIUS) // CELL_SIZE)
+
+        for row in range(row_min, row_max + 1):
+            for col in range(col_min, col_max + 1):
+                if self.is_wall(row, col):
+                    # Closest point of the cell to the robot centre
+                    near_y = min(max(y, row * CELL_SIZE), (row + 1) * CELL_SIZE)
+                    near_x = min(max(x, col * CELL_SIZE), (col + 1) * CELL_SIZE)
+                    if (near_y - y) ** 2 + (near_x - x) ** 2 < ROBOT_RADIUS ** 2:
+                        return True
+        return False
+
+    # Move robot dt seconds
+    def step(self, dt):
+        target_speed = (self.target_left + self.target_right) / 2
+        target_rotation = (self.target_right - self.target_left) / TRACK_WIDTH
+        self.speed += (target_speed - self.speed) * (1 - math.exp(-dt / DRIVE_TIME_CONSTANT))
+        self.rotation += (target_rotation - self.rotation) * \
+            (1 - math.exp(-dt / TURN_TIME_CONSTANT))
+
+        speed = self.speed
+        rotation = self.rotation
+
+        self.angle += rotation * dt
+        new_y = self.y - math.cos(self.angle) * speed * dt
+        new_x = self.x - math.sin(self.angle) * speed * dt
+
+        if self.is_blocked(new_y, new_x):
+            if not self.is_blocked(self.y, self.x):
+                self.collisions += 1
+            self.speed = self.rotation = 0.0
+        else:
+            self.distance += abs(speed) * dt
+            self.y, self.x = new_y, new_x
+
+        self.speed_left = self.speed - self.rotation * TRACK_WIDTH / 2
+        self.speed_right = self.speed + self.rotation * TRACK_WIDTH / 2
+
+        # Odometer counts wheel movement in either direction
+        self.odometer += (abs(self.speed_left) +
+                          abs(self.speed_right)) / 2 * dt / TICK_LENGTH
+
+    # Distance in cm from (y, x) along direction to first wall (DDA grid walk)
+    def cast_ray(self, y, x, dir_y, dir_x):
+        row, col = int(y // CELL_SIZE), int(x // CELL_SIZE)
+        if self.is_wall(row, col):
+            return 0.0
+
+        step_row = 1 if dir_y > 0 else -1
+        step_col = 1 if dir_x > 0 else -1
+        delta_y = abs(CELL_SIZE / dir_y) if dir_y else math.inf
+        delta_x = abs(CELL_SIZE / dir_x) if dir_x else math.inf
+        next_y = ((row + (step_row > 0)) * CELL_SIZE - y) / dir_y if dir_y else math.inf
+        next_x = ((col + (step_col > 0)) * CELL_SIZE - x) / dir_x if dir_x else math.inf
+
+        distance = 0.0
+        while distance < IR_MAX_RANGE:
+            if next_y < next_x:
+                distance = next_y
+                next_y += delta_y
+                row += step_row
+            else:
+                distance = next_x
+                next_x += delta_x
+                col += step_col
+
+            if self.is_wall(row, col):
+                return min(distance, IR_MAX_RANGE)
+
+        return IR_MAX_RANGE
+
+    # Raw IR value for a distance, inverse of ir_conversion.linearize_ir_data
+    def ir_value(self, distance):
+        if self.noise:
+            distance += self.random.gauss(0, self.noise)
+
+        value = 2914 / (5.104 * max(distance, 0) + 1) - 5
+        return min(max(round(value), 0), 255)
+
+    # Distance seen by a sensor at offset from centre looking along angle
+    def read_ir(self, angle, offset):
+        dir_y = -math.cos(angle)
+        dir_x = -math.sin(angle)
+        return self.cast_ray(self.y + dir_y * offset, self.x + dir_x * offset, dir_y, dir_x)
+
+    # Register file of the sensor module
+    def get_registers(self):
+        ir_front = self.ir_value(self.read_ir(self.angle, FRONT_SENSOR_OFFSET))
+        ir_left = self.ir_value(self.read_ir(
+            self.angle + math.pi / 2, SIDE_SENSOR_OFFSET) - IR_LEFT_BIAS)
+        ir_right = self.ir_value(self.read_ir(
+            self.angle - math.pi / 2, SIDE_SENSOR_OFFSET))
+
+        rotation = math.degrees(
+            (self.speed_right - self.speed_left) / TRACK_WIDTH)
+        gyro = min(max(round(self.gyro_offset + rotation / GYRO_SCALE), 0), 255)
+
+        odometer = int(self.odometer) & 0xFFFF
+
+        return [self.automatic_drive, ir_front, ir_left, ir_right,
+                odometer >> 8, odometer & 0xFF, gyro, self.start_drive]
+
+    # Toggle start button, same as the button on the robot
+    def press_start(self):
+        self.start_drive = 0 if self.start_drive else 1
+
+
+# Drop-in replacement for smbus.SMBus talking to the simulated world
+class Sim_bus:
+    def __init__(self, world, clock):
+        self.world = world
+        self.clock = clock
+        self.selected = 0
+        self.transactions = 0
+
+    # Every transaction takes time on the bus
+    def transfer(self, n):
+        self.transactions += 1
+        self.clock.advance((n + 1) * BYTE_TIME)
+
+    def check_address(self, address):
+        if address not in (SENSOR_ADDRESS, MOTOR_ADDRESS):
+            raise OSError("No device at address " + hex(address))
+
+    def write_byte(self, address, value):
+        self.check_address(address)
+        self.transfer(1)
+
+        if address == MOTOR_ADDRESS:
+            self.world.write_motor(value)
+        else:
+            self.selected = value
+
+    def read_byte(self, address):
+        self.check_address(address)
+        self.transfer(1)
+
+        if address == MOTOR_ADDRESS:
+            raise OSError("Motor module does not transmit")
+
+        registers = self.world.get_registers()
+        return registers[self.selected] if self.selected < len(registers) else 255
+
+    def write_i2c_block_data(self, address, cmd, data):
+        self.check_address(address)
+        self.transfer(1 + len(data))
+
+        if address == MOTOR_ADDRESS:
+            # Motor module handles every received byte as a command
+            for value in [cmd] + list(data):
+                self.world.write_motor(value)
+        else:
+            self.selected = cmd
+
+    def read_i2c_block_data(self, address, cmd, length=32):
+        self.check_address(address)
+        self.transfer(2 + length)
+
+        if address == MOTOR_ADDRESS:
+            raise OSError("Motor module does not transmit")
+
+        # Sensor module auto-increments register on every byte
+        self.selected = cmd
+        registers = self.world.get_registers() + [255] * length
+        return registers[cmd:cmd + length]
+
+    def close(self):
+        pass
+
+
+# Server stand-in that accepts and counts map updates
+class Null_server:
+    def __init__(self):
+        self.messages = 0
+        self.active = False
+
+    def init_map(self, map, pos):
+        pass
+
+    def put_wall(self, x, y=-1):
+        self.messages += 1
+
+    def put_empty(self, x, y=-1):
+        self.messages += 1
+
+    def put_robot(self, x, y=-1):
+        self.messages += 1
+
+    def put_unknown(self, x, y=-1):
+        self.messages += 1
+
+    def put_path(self, x, y=-1):
+        self.messages += 1
+
+    def reset_mapping_started(self):
+        pass
+
+    def reset_mapping_stopped(self):
+        pass
+
+    def reset_mapping_paused(self):
+        pass
+
+    def reset_mapping_unpaused(self):
+        pass
+
+
+# Motor that tells the world when it turns, so turns can be measured
+class Sim_motor(styrmodul.Motor):
+    def __init__(self, bus, sensor, world):
+        super().__init__(bus, sensor)
+        self.world = world
+
+    def turn(self, direction, n):
+        world = self.world
+        world.end_turn()
+        world.turn_start = world.angle
+        world.turn_target = 90 * n
+        world.turning = True
+        try:
+            super().turn(direction, n)
+        finally:
+            world.turning = False
+
+
+# World, clock and bus wired together
+class Simulation:
+    def __init__(self, maze=DEFAULT_MAZE, noise=0.0, seed=0, gyro_offset=GYRO_OFFSET):
+        self.world = Maze_world(maze, noise=noise, seed=seed, gyro_offset=gyro_offset)
+        self.clock = Sim_clock(self.world)
+        self.bus = Sim_bus(self.world, self.clock)
+
+    # Replace the time module in the given modules with the simulation
+    # clock, returns what was replaced for restore_time
+    def patch_time(self, *modules):
+        replaced = {}
+        for module in modules or (sensormodul, styrmodul, heading):
+            replaced[module] = module.time
+            module.time = self.clock
+
+        return replaced
+
+    def restore_time(self, replaced):
+        for module, time_module in replaced.items():
+            module.time = time_module
+
+    # Run a full mapping with the real Sensor, Motor and Autopilot
+    def run_autopilot(self, time_limit=DEFAULT_TIME_LIMIT, server=None):
+        replaced = self.patch_time()
+        try:
+            sensor = sensormodul.Sensor(self.bus)
+            motor = Sim_motor(self.bus, sensor, self.world)
+            motor.verbose = False
+            autopilot = auto.Autopilot(motor, server or Null_server())
+            autopilot.verbose = False
+
+            autopilot.start_mapping()
+            cycles = 0
+
+            while autopilot.is_mapping() and self.clock.time() < time_limit:
+                data = sensor.read_sensors()
+                autopilot.cycle_autopilot((data[1], data[2], data[3]))
+                cycles += 1
+
+            motor.stop()
+            end_time = self.clock.time()
+
+            # Let the robot come to rest to measure the last turn
+            self.clock.sleep(COAST_TIME)
+            self.world.end_turn()
+
+            return {
+                "done": not autopilot.is_mapping(),
+                "cycles": cycles,
+                "sim_time": round(end_time, 2),
+                "distance": round(self.world.distance, 1),
+                "collisions": self.world.collisions,
+                "transactions": self.bus.transactions,
+                "pos": autopilot.get_pos(),
+                "robot_pos": self.world.get_pos(),
+                "turn_errors": [round(error, 1) for error in self.world.turn_errors],
+            }
+        finally:
+            self.restore_time(replaced)
+
+
+# Read maze from file, one row per line
+def read_maze(path):
+    with open(path) as f:
+        return [line.rstrip("\n") for line in f if line.strip()]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Run the autopilot in a simulated maze")
+    parser.add_argument("maze", nargs="?", help="maze file, one row per line")
+    parser.add_argument("--noise", type=float, default=0.0,
+                        help="standard deviation of IR distance noise in cm")
+    parser.add_argument("--gyro-offset", type=int, default=GYRO_OFFSET,
+                        help="gyro value when still")
+    args = parser.parse_args()
+
+    maze = read_maze(args.maze) if args.maze else DEFAULT_MAZE
+
+    simulation = Simulation(maze, noise=args.noise, gyro_offset=args.gyro_offset)
+    result = simulation.run_autopilot()
+
+    for key, value in result.items():
+        print(key + ":", value)
+
+    return 0 if result["done"] else 1
+
+
+if __name__ == '__main__':
+    main()
@@ -1,33 +1,76 @@
-import smbus
+import math
 import time
-import sensormodul
 import json
+import heading
+import fusion
 
 GYRO_GAIN = 1/3
 TURN_COEFF = 90*GYRO_GAIN
 STOP_TURN_COEFF = 3.0
-GYRO_OFFSET = 127
+STOP_TURN_RATE = 1  # Gyro units, slower rotation is standing still
+MAX_TURN_COAST = 0.5  # s, longest wait for a turn to coast to a stop
 DRIVE_COEFF = 84
 STOP_DRIVE_COEFF = 11
+STOP_DRIVE_TIME = 0.1  # s without odometer ticks that is standing still
+MAX_DRIVE_COAST = 1.0  # s, longest wait for a drive to coast to a stop
 IR_FAIL_SAFE_COEFF = 15
+IR_FAIL_SAFE_SAMPLES = 2  # Close front readings in a row that stop a drive
 MOTOR_ADDRESS = 0x7F
 GYRO_INTERNAL_ADDRESS = 6
 KP = -0.027
 KD = -0.025
-GYRO_REGULATION_FACTOR = 0.005
 MAX_REGULATION_DIFF = 0.2
-WANTED_WALL_DISTANCE = 11
-REGULATOR_DISTANCE_THRESHOLD = 20
-KD_TIME_DELTA = 0.5
+CELL_LENGTH = 40  # cm, driven per DRIVE_COEFF odometer ticks
+DRIVE_SPEED = 0.6
 PD_REGULATION = True
-GYRO_REGULATION = True
+# Write both motor bytes in one I2C transaction instead of two with delays
+BLOCK_WRITE = True
+
+# Motor command byte: bit 7 side (0 left, 1 right), bit 6 direction
+# (1 forward), bits 0-5 speed 0-63
+MAX_SPEED_LEVEL = 63
+LEFT_FORWARD = 0b01000000
+LEFT_BACKWARD = 0b00000000
+RIGHT_FORWARD = 0b11000000
+RIGHT_BACKWARD = 0b10000000
+SPEED_LEVELS = range(MAX_SPEED_LEVEL + 1)
+
+# Left and right wheel bytes for every direction and speed level.
+# fwd_right and fwd_left run the inner wheel at a quarter speed
+LEFT_BYTES = {
+    "fwd": [LEFT_FORWARD | level for level in SPEED_LEVELS],
+    "back": [LEFT_BACKWARD | level for level in SPEED_LEVELS],
+    "right": [LEFT_FORWARD | level for level in SPEED_LEVELS],
+    "left": [LEFT_BACKWARD | level for level in SPEED_LEVELS],
+    "fwd_right": [LEFT_FORWARD | level for level in SPEED_LEVELS],
+    "fwd_left": [LEFT_FORWARD | level >> 2 for level in SPEED_LEVELS],
+    "stop": [LEFT_BACKWARD for level in SPEED_LEVELS],
+}
+RIGHT_BYTES = {
+    "fwd": [RIGHT_FORWARD | level for level in SPEED_LEVELS],
+    "back": [RIGHT_BACKWARD | level for level in SPEED_LEVELS],
+    "right": [RIGHT_BACKWARD | level for level in SPEED_LEVELS],
+    "left": [RIGHT_FORWARD | level for level in SPEED_LEVELS],
+    "fwd_right": [RIGHT_FORWARD | level >> 2 for level in SPEED_LEVELS],
+    "fwd_left": [RIGHT_FORWARD | level for level in SPEED_LEVELS],
+    "stop": [RIGHT_BACKWARD for level in SPEED_LEVELS],
+}
+
+
+# Speed 0 to 1 as speed level 0 to MAX_SPEED_LEVEL
+def get_speed_level(n):
+    return min(max(round(n * MAX_SPEED_LEVEL), 0), MAX_SPEED_LEVEL)
 
 
 class Motor:
     def __init__(self, bus, sensor):
         self.bus = bus
         self.sensor = sensor
+        self.gyro = heading.Heading_integrator(sensor)
+        self.filter = fusion.Drive_filter(
+            sensor, TURN_COEFF / (math.pi / 2), CELL_LENGTH / DRIVE_COEFF)
         self.direction = None
+        self.command = None  # Last (left, right) bytes written
         self.verbose = True
 
     def log(self, msg):
@@ -39,48 +82,56 @@ class Motor:
                 print(msg)
             print("\n")
 
-    # Stop motors
+    # Stop motors, always sent even if the last command was stop
     def stop(self):
 
+        self.command = None
         self.set_movement('stop')
 
     # Turn left 90*n degrees
-
     def turn_left(self, n):
-        total_rotation = 0
+        self.turn('left', n)
+
+    # Turn right 90*n degrees
+    def turn_right(self, n):
+        self.turn('right', n)
+
+    # Turn 90*n degrees in direction 'left' or 'right', heading from the
+    # gyro integrator
+    def turn(self, direction, n):
+        sign = 1 if direction == 'left' else -1
         speed = 0.75
         max_reached = False
         slowed_down = False
         slowed_down_rotation = TURN_COEFF/2
         expected_rotation = TURN_COEFF*n-STOP_TURN_COEFF
 
-        self.sensor.set_sensor(sensormodul.Internal_address.GYRO)
+        # Standing still, update gyro bias before turning
+        self.gyro.estimate_bias()
+        self.gyro.reset()
 
-        self.set_movement('left', speed)
+        self.set_movement(direction, speed)
 
-        start_time = time.time()
-        speed_change_time = start_time
+        speed_change_time = time.time()
 
         while True:
 
-            # Calculate the time passed since start of rotation
+            # Rotation since start of turn
+            total_rotation = sign * self.gyro.update()
             new_time = time.time()
-            time_passed = new_time - start_time
-            total_rotation = total_rotation + time_passed * \
-                (self.sensor.read_current_sensor() - GYRO_OFFSET)
 
             # Increase speed every 0.05 seconds
             if not max_reached and not slowed_down:
                 if (new_time - speed_change_time) >= 0.05 and speed < 1:
                     speed = speed + 0.05
-                    self.set_movement('left', speed)
+                    self.set_movement(direction, speed)
                     speed_change_time = new_time
                 elif speed == 1:
                     max_reached = True
 
             # Slow down, preparation for stop
             if total_rotation >= expected_rotation-slowed_down_rotation and not slowed_down:
-                self.set_movement('left', 0.5)
+                self.set_movement(direction, 0.5)
                 slowed_down = True
 
             # If turned 90*n degrees stop (cefficient calculated with tests)
@@ -88,88 +139,22 @@ class Motor:
                 self.set_movement('stop')
                 break
 
-            start_time = new_time
-
-    # Same as turn_left with different handling of the gyro value
-    def turn_right(self, n):
-
-        total_rotation = 0
-        speed = 0.75
-        expected_rotation = TURN_COEFF*n-STOP_TURN_COEFF
-        slowed_down_rotation = TURN_COEFF/2
-        max_reached = False
-        slowed_down = False
-
-        self.sensor.set_sensor(sensormodul.Internal_address.GYRO)
-
-        self.set_movement('right', speed)
-
-        start_time = time.time()
-        speed_change_time = start_time
-
-        while True:
-
-            new_time = time.time()
-            time_passed = new_time - start_time
-            total_rotation = total_rotation + time_passed * \
-                (GYRO_OFFSET - self.sensor.read_current_sensor())
-
-            if not max_reached and not slowed_down:
-                if (new_time - speed_change_time) >= 0.05 and speed < 1:
-                    speed = speed + 0.05
-                    self.set_movement('right', speed)
-                    speed_change_time = new_time
-                elif speed == 1:
-                    max_reached = True
-
-            if total_rotation >= expected_rotation-slowed_down_rotation and not slowed_down:
-                self.set_movement('right', 0.5)
-                slowed_down = True
-
-            if total_rotation >= expected_rotation:
-                self.set_movement('stop')
-                break
-
-            start_time = new_time
-
-    def reg_value(self, distance, last_distance):
-        reg_add = 0
-
-        if distance < REGULATOR_DISTANCE_THRESHOLD:
-            if PD_REGULATION:
-                D_value = KD * (distance - last_distance) / KD_TIME_DELTA
-                self.log("distance: " + str(distance) +
-                         "\nlast_distance: " + str(last_distance))
-            else:
-                D_value = 0
-
-            P_value = KP * (distance - WANTED_WALL_DISTANCE)
-
-            reg_add = P_value + D_value
-            self.log("KP: " + str(P_value) + "KD: " + str(D_value))
-            # Make sure the resulting value not get overflow
-            reg_add = reg_add if reg_add <= MAX_REGULATION_DIFF else MAX_REGULATION_DIFF
-            reg_add = reg_add if reg_add >= -MAX_REGULATION_DIFF else -MAX_REGULATION_DIFF
-
-            self.log(reg_add)
-        return reg_add
-
-    def reg_value_gyro(self, gyro, last_gyro):
-        gyro = gyro - 127
-        last_gyro = last_gyro - 127
-        reg_add = 0
-
-        if PD_REGULATION:
-            D_value = KD * (gyro - last_gyro) / KD_TIME_DELTA
-            self.log("distance: " + str(gyro) +
-                     "\nlast_distance: " + str(last_gyro))
-        else:
-            D_value = 0
-
-        P_value = KP * (gyro - 127)
-
-        reg_add = (P_value + D_value) * GYRO_REGULATION_FACTOR
-        self.log("KP: " + str(P_value) + "KD: " + str(D_value))
+        # Coast to a stop, a drive keeps the heading it starts with and
+        # scans need the robot still
+        stop_time = time.time()
+        while abs(self.gyro.get_rate()) > STOP_TURN_RATE \
+                and time.time() - stop_time < MAX_TURN_COAST:
+            self.gyro.update()
+
+    # offset is cm from the corridor centre line and offset_rate cm/s,
+    # both positive to the left, from the drive filter
+    def reg_value(self, offset, offset_rate):
+        P_value = KP * offset
+        D_value = KD * offset_rate if PD_REGULATION else 0
+
+        reg_add = P_value + D_value
+        self.log("offset: " + str(offset) + "\noffset_rate: " + str(offset_rate) +
+                 "\nKP: " + str(P_value) + "KD: " + str(D_value))
         # Make sure the resulting value not get overflow
         reg_add = reg_add if reg_add <= MAX_REGULATION_DIFF else MAX_REGULATION_DIFF
         reg_add = reg_add if reg_add >= -MAX_REGULATION_DIFF else -MAX_REGULATION_DIFF
@@ -177,79 +162,87 @@ class Motor:
         self.log(reg_add)
         return reg_add
 
-    def drive_forward(self, n):
+    # Drive n squares in one motion. on_square is called every time the
+    # robot centre crosses into the next square. on_centre(ir_data, last) is
+    # called with (ir_front, ir_left, ir_right) at the centre of every
+    # square, for the last square where braking starts with ir_front as
+    # seen from the centre. If it returns True for the last square the
+    # drive continues one more square. Returns the number of squares
+    # crossed, fewer than n after a fail safe stop
+    def drive_forward(self, n, on_square=None, on_centre=None):
 
         # Get initial odometer value
         odometer_old = self.sensor.get_odometer()
+        squares = 0
+        scanned = 0
+        close_readings = 0
+
+        # Offset and heading estimates start over for every drive
+        self.filter.reset(self.gyro.bias)
 
         # Start driving forward
         self.set_movement('fwd', 0.7)
 
-        # PD_REGULATION
-        start_time = round(time.time(), 1)
-        past_values = {}
+        while True:
 
-        reg_left = False
-        reg_right = False
+            # Filter all new samples, paces the loop at the sample rate
+            data = self.filter.update()
 
-        while True:
-            now = round(time.time(), 1)
-
-            ir_right = self.sensor.get_ir_right()
-            ir_left = self.sensor.get_ir_left()
-            gyro = self.sensor.get_gyro()
-
-            # PD REGULATION
-            past_values[str(now)] = (ir_right, ir_left, gyro)
-            # wait until KD_TIME_DELTA has passed before first PD term can be added
-            if now - start_time > KD_TIME_DELTA:
-                past_val = past_values.get(str(now - KD_TIME_DELTA))
-                last_ir_right = past_val[0] or ir_right
-                last_ir_left = past_val[1] or ir_left
-                last_gyro = past_val[2] or gyro
-            else:
-                last_ir_right = ir_right
-                last_ir_left = ir_left
-                last_gyro = gyro
-
-            speed_left = 0.6
-            speed_right = 0.6
-            
-
-            if ir_right < REGULATOR_DISTANCE_THRESHOLD and ir_right < ir_left and not reg_left:
-                reg_right = True
-
-                reg = self.reg_value(ir_right, last_ir_right)
-                speed_right += reg
-                speed_left -= reg
-            elif ir_left < REGULATOR_DISTANCE_THRESHOLD and ir_left < ir_right and not reg_right:
-                reg_left = True
-
-                reg = self.reg_value(ir_left, last_ir_left)
-                speed_left += reg
-                speed_right -= reg
-            else:  # gyro
-                if GYRO_REGULATION:
-                    reg = self.reg_value_gyro(gyro, last_gyro)
-                    speed_left += reg
-                    speed_right -= reg
-
-                reg_right = False
-                reg_left = False
+            speed_left = DRIVE_SPEED
+            speed_right = DRIVE_SPEED
 
-            self.set_movement("fwd", speed_left, speed_right)
+            # Steer towards the centre line, from walls when in sight and
+            # from gyro and odometer in between
+            reg = self.reg_value(self.filter.get_offset(), self.filter.get_offset_rate())
+            speed_right += reg
+            speed_left -= reg
 
-            # Get current odometer value
-            odometer = self.sensor.get_odometer()
+            self.set_movement("fwd", speed_left, speed_right)
 
-            # Get current ir_front value
-            ir_front = self.sensor.get_ir_front()
+            # Get odometer and ir_front values from the same snapshot
+            odometer = data.odometer
+            ir_front = data.ir_front
+            driven = odometer - odometer_old
+
+            # Square boundaries are half a square from the square centres
+            while squares < n and driven >= DRIVE_COEFF*(squares + 0.5):
+                squares += 1
+                if on_square is not None:
+                    on_square()
+
+            # Scan the square when passing its centre
+            if on_centre is not None and scanned < squares:
+                last = scanned + 1 == n
+                if driven >= (DRIVE_COEFF*n-STOP_DRIVE_COEFF if last else DRIVE_COEFF*(scanned + 1)):
+                    scanned += 1
+
+                    # The last square is scanned before its centre, give the
+                    # front distance as seen from the centre
+                    to_centre = (DRIVE_COEFF*scanned - driven) * CELL_LENGTH / DRIVE_COEFF
+                    ir_data = (ir_front - to_centre, data.ir_left, data.ir_right)
+                    if on_centre(ir_data, last) and last:
+                        n += 1
+
+            # A single close front reading may be noise
+            close_readings = close_readings + 1 if ir_front <= IR_FAIL_SAFE_COEFF else 0
 
             # Stop if driven 40*n cm (cefficient calculated with tests) or if about to drive into wall
-            if ((odometer - odometer_old) >= (DRIVE_COEFF*n-STOP_DRIVE_COEFF)) or ir_front <= IR_FAIL_SAFE_COEFF:
+            if (driven >= (DRIVE_COEFF*n-STOP_DRIVE_COEFF)) or close_readings >= IR_FAIL_SAFE_SAMPLES:
                 self.set_movement('stop')
                 break
 
+        # Coast to a stop, scans and the next drive or turn need the robot
+        # still. Stopped when the odometer has not counted for a while
+        stop_time = tick_time = time.time()
+        while time.time() - tick_time < STOP_DRIVE_TIME \
+                and time.time() - stop_time < MAX_DRIVE_COAST:
+            data = self.filter.update()
+            if data.odometer != odometer:
+                odometer = data.odometer
+                tick_time = time.time()
+
+        return squares
+
     # Same as drive_forward without IR fail safe and regulation
     def drive_backward(self, n):
 
@@ -260,85 +253,40 @@ class Motor:
 
         while True:
 
-            odometer = self.sensor.get_odometer()
+            odometer = self.sensor.read_snapshot().odometer
 
             if (odometer - odometer_old) >= (DRIVE_COEFF*n-STOP_DRIVE_COEFF):
                 self.set_movement('stop')
                 break
 
-    # Conver direction and speed to bytes and send to I2C
-
+    # Convert direction and speed to bytes and send to I2C. Speeds are 0 to 1,
+    # n1 is the right wheel speed when driving forward if set
     def set_movement(self, direction, n=0, n1=0):
 
-        speed = format(round(n*63), '06b')
-
-        if direction == "fwd":
-            # speed = 0b11111111 if regspeed == 0 else regspeed
+        if direction not in LEFT_BYTES:
+            return
 
-            speed_left = int("01" + speed, 2)
+        speed = get_speed_level(n)
+        speed1 = get_speed_level(n1) if n1 and direction == "fwd" else speed
 
-            speed1 = format(round(n1*63), '06b') if n1 else speed
-            speed_right = int("11" + speed1, 2)
+        command = (LEFT_BYTES[direction][speed], RIGHT_BYTES[direction][speed1])
 
-            self.bus.write_byte(MOTOR_ADDRESS, speed_left)
-            time.sleep(0.005)
-            self.bus.write_byte(MOTOR_ADDRESS, speed_right)
-            time.sleep(0.001)
-
-        elif direction == "back":
-            speed_left = int("00" + speed, 2)
-            speed_right = int("10" + speed, 2)
-            self.bus.write_byte(MOTOR_ADDRESS, speed_left)
-            time.sleep(0.005)
-            self.bus.write_byte(MOTOR_ADDRESS, speed_right)
-            time.sleep(0.001)
-
-        elif direction == "right":
-            speed_left = int("01" + speed, 2)
-            speed_right = int("10" + speed, 2)
-            self.bus.write_byte(MOTOR_ADDRESS, speed_left)
-            time.sleep(0.005)
-            self.bus.write_byte(MOTOR_ADDRESS, speed_right)
-            time.sleep(0.001)
+        # Motors keep running the last command, no need to send it again
+        if command != self.command:
+            self.write_command(command)
 
-        elif direction == "left":
-
-            speed_left = int("00" + speed, 2)
-            speed_right = int("11" + speed, 2)
-            self.bus.write_byte(MOTOR_ADDRESS, speed_left)
-            time.sleep(0.005)
-            self.bus.write_byte(MOTOR_ADDRESS, speed_right)
-            time.sleep(0.001)
-
-        elif direction == "fwd_right":
-
-            slower_wheel = format(int(speed, 2) >> 2, '06b')
-
-            speed_left = int("01" + speed, 2)
-            speed_right = int("11" + slower_wheel, 2)
-
-            self.bus.write_byte(MOTOR_ADDRESS, speed_left)
-            time.sleep(0.005)
-            self.bus.write_byte(MOTOR_ADDRESS, speed_right)
-            time.sleep(0.001)
-
-        elif direction == "fwd_left":
-            slower_wheel = format(int(speed, 2) >> 2, '06b')
-
-            speed_left = int("01" + slower_wheel, 2)
-            speed_right = int("11" + speed, 2)
-            self.bus.write_byte(MOTOR_ADDRESS, speed_left)
-            time.sleep(0.005)
-            self.bus.write_byte(MOTOR_ADDRESS, speed_right)
-            time.sleep(0.001)
+        self.direction = direction
 
-        elif direction == "stop":
+    def write_command(self, command):
+        speed_left, speed_right = command
 
-            speed_left = 0b00000000
-            speed_right = 0b10000000
+        if BLOCK_WRITE:
+            # Both bytes in one transaction, the motor AVR handles every byte
+            self.bus.write_i2c_block_data(MOTOR_ADDRESS, speed_left, [speed_right])
+        else:
             self.bus.write_byte(MOTOR_ADDRESS, speed_left)
             time.sleep(0.005)
             self.bus.write_byte(MOTOR_ADDRESS, speed_right)
             time.sleep(0.001)
 
-        self.direction = direction
+        self.command = command